@@ -0,0 +1,56 @@
+import numpy as np
+
+# Same radius as starsep_utils.haversine, in metres
+EARTH_RADIUS = 6373000.0
+# Upper bound of relative error of equirectangularMany for distances below
+# PREFILTER_MAX_DISTANCE, checked against haversine
+PREFILTER_RELATIVE_ERROR = 0.01
+PREFILTER_MAX_DISTANCE = 100000
+
+
+def haversineMany(
+    lat: float, lon: float, lats: np.ndarray, lons: np.ndarray
+) -> np.ndarray:
+    """Distances in metres from (lat, lon) to every point, not truncated."""
+    return haversinePairwise(np.array([lat]), np.array([lon]), lats, lons)[0]
+
+
+def haversinePairwise(
+    lats1: np.ndarray, lons1: np.ndarray, lats2: np.ndarray, lons2: np.ndarray
+) -> np.ndarray:
+    """Matrix of distances in metres, rows for the first set of points."""
+    lat1 = np.radians(np.asarray(lats1, dtype=np.float64))[:, np.newaxis]
+    lon1 = np.radians(np.asarray(lons1, dtype=np.float64))[:, np.newaxis]
+    lat2 = np.radians(np.asarray(lats2, dtype=np.float64))[np.newaxis, :]
+    lon2 = np.radians(np.asarray(lons2, dtype=np.float64))[np.newaxis, :]
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def equirectangularMany(
+    lat: float, lon: float, lats: np.ndarray, lons: np.ndarray
+) -> np.ndarray:
+    """Cheap approximation of haversineMany, good for short distances."""
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    lat, lon = np.radians(lat), np.radians(lon)
+    x = (lons - lon) * np.cos((lats + lat) / 2)
+    y = lats - lat
+    return EARTH_RADIUS * np.hypot(x, y)
+
+
+def prefilterNearest(
+    lat: float, lon: float, lats: np.ndarray, lons: np.ndarray
+) -> np.ndarray:
+    """Mask of points which may be nearest to (lat, lon) by haversine.
+    Everything is kept when the nearest point is too far for the approximation."""
+    approximate = equirectangularMany(lat, lon, lats, lons)
+    closest = approximate.min(initial=np.inf)
+    if closest > PREFILTER_MAX_DISTANCE:
+        return np.ones(len(approximate), dtype=bool)
+    slack = (1 + PREFILTER_RELATIVE_ERROR) / (1 - PREFILTER_RELATIVE_ERROR)
+    # + 2 metres keeps everything which truncates to the same distance
+    return approximate <= closest * slack + 2
@@ -0,0 +1,321 @@
+#!/usr/bin/env -S uv run python
+import argparse
+import atexit
+import gzip
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+from xml.sax.saxutils import quoteattr
+
+from starsep_utils import OverpassResult
+
+# Caches and metrics of the pipeline go to a temporary directory, so
+# benchmarks never touch those of real runs
+os.environ["NEXTBIKEOSM_CACHE"] = tempfile.mkdtemp(prefix="nextbikeosm-benchmark-")
+import nextbike_parser as NP
+from mevo_comparator import MevoComparator
+from mevo_parser import MevoParser, parseStations
+from name_similarity import NAME_RATIO_VERSION, cacheNames
+from nextbike_valid import NextbikeValidator, nextbike_run, nextbikeOverpassRequest
+from overpass_parser import cacheOverpass, parseOverpassElements
+from roovee_comparator import RooveeComparator
+from roovee_parser import RooveeParser, parsePlaces
+
+atexit.register(shutil.rmtree, os.environ["NEXTBIKEOSM_CACHE"], ignore_errors=True)
+
+benchmarksDirectory = Path("benchmarks")
+# Number of cities, each with STATIONS_PER_CITY stations
+SIZES = {"city": 1, "region": 10, "country": 100}
+STATIONS_PER_CITY = 200
+CITY_SPREAD = 0.05
+# Slower than baseline by more than this fraction is reported as regression
+REGRESSION_THRESHOLD = 0.1
+NETWORK_NAME = "nextbike Benchmark"
+_STREETS = ["Dworcowa", "Kościuszki", "Łąkowa", "Mickiewicza", "Rynek", "Żwirki"]
+_SUFFIXES = ["", " - Park", " / Szkoła", " (Pętla)"]
+
+
+def syntheticStations(cities: int, seed: int = 1) -> list[list[dict]]:
+    """Stations of cities spread over Poland, numbered from 1 in each city"""
+    rnd = random.Random(seed)
+    result = []
+    for _ in range(cities):
+        lat, lon = rnd.uniform(49.5, 54.5), rnd.uniform(14.5, 23.5)
+        result.append(
+            [
+                dict(
+                    number=number,
+                    name=f"{rnd.choice(_STREETS)} {rnd.randint(1, 99)}"
+                    + rnd.choice(_SUFFIXES),
+                    lat=lat + rnd.uniform(-CITY_SPREAD, CITY_SPREAD),
+                    lon=lon + rnd.uniform(-CITY_SPREAD, CITY_SPREAD),
+                    capacity=rnd.randint(5, 20),
+                )
+                for number in range(1, STATIONS_PER_CITY + 1)
+            ]
+        )
+    return result
+
+
+def nextbikeXML(cities: list[list[dict]]) -> bytes:
+    """nextbike-official.xml with all cities in a single network"""
+    lines = [
+        "<markers>",
+        f'<country name="{NETWORK_NAME}" country="PL">',
+    ]
+    for cityIndex, stations in enumerate(cities):
+        lines.append(f'<city uid="{cityIndex + 1}" name="Miasto {cityIndex + 1}">')
+        for station in stations:
+            lines.append(
+                f'<place uid="{cityIndex * STATIONS_PER_CITY + station["number"]}"'
+                f' lat="{station["lat"]}" lng="{station["lon"]}"'
+                f' name={quoteattr(station["name"])} number="{station["number"]}"'
+                f' bike_racks="{station["capacity"]}" place_type="0"/>'
+            )
+        lines.append("</city>")
+    lines += ["</country>", "</markers>"]
+    return "\n".join(lines).encode()
+
+
+def stationInformationJSON(cities: list[list[dict]]) -> bytes:
+    """GBFS station_information.json"""
+    stations = [
+        dict(
+            station_id=f"{cityIndex}-{station['number']}",
+            name=station["name"],
+            lat=station["lat"],
+            lon=station["lon"],
+            capacity=station["capacity"],
+        )
+        for cityIndex, cityStations in enumerate(cities)
+        for station in cityStations
+    ]
+    return json.dumps({"data": {"stations": stations}}).encode()
+
+
+def bikesAndZonesJSON(cities: list[list[dict]]) -> bytes:
+    """Roovee bikesAndZones response, with an operations zone per city"""
+    zones = []
+    for stations in cities:
+        zones.append(
+            {"type": "operationsZone", "name": "", "areaCenter": {"lat": 0, "lng": 0}}
+        )
+        zones += [
+            dict(
+                type="preferredBikeReturnZone",
+                name=station["name"],
+                areaCenter=dict(lat=station["lat"], lng=station["lon"]),
+            )
+            for station in stations
+        ]
+    return json.dumps({"zones": zones}).encode()
+
+
+def overpassElements(cities: list[list[dict]], seed: int = 2) -> list[dict]:
+    """Overpass JSON elements mapping most of stations. Mapped ones are moved
+    a bit, some without ref or drawn as ways, some renamed or moved far."""
+    rnd = random.Random(seed)
+    nodes: list[dict] = []
+    ways: list[dict] = []
+
+    def node(lat: float, lon: float, tags: dict | None = None) -> int:
+        nodes.append(dict(type="node", id=len(nodes) + 1, lat=lat, lon=lon))
+        if tags is not None:
+            nodes[-1]["tags"] = tags
+        return len(nodes)
+
+    for stations in cities:
+        for station in stations:
+            r = rnd.random()
+            if r < 0.1:
+                continue
+            tags = dict(amenity="bicycle_rental", name=station["name"])
+            if rnd.random() < 0.8:
+                tags["ref"] = str(station["number"])
+            if rnd.random() < 0.1:
+                tags["name"] = tags["name"].upper()
+            # Most are mapped close, some far enough to need name matching
+            shift = 0.0001 if rnd.random() < 0.9 else 0.005
+            lat = station["lat"] + rnd.uniform(-shift, shift)
+            lon = station["lon"] + rnd.uniform(-shift, shift)
+            if r < 0.2:
+                corners = [
+                    node(lat + dLat, lon + dLon)
+                    for dLat, dLon in [(0, 0), (0, 1e-4), (1e-4, 1e-4), (1e-4, 0)]
+                ]
+                ways.append(
+                    dict(
+                        type="way",
+                        id=len(ways) + 1,
+                        nodes=corners + corners[:1],
+                        tags=tags,
+                    )
+                )
+            else:
+                node(lat, lon, tags)
+        # Former stations, which are reported but never matched
+        for _ in range(len(stations) // 20):
+            station = rnd.choice(stations)
+            node(
+                station["lat"] + rnd.uniform(-0.01, 0.01),
+                station["lon"] + rnd.uniform(-0.01, 0.01),
+                {"amenity": "bicycle_parking", "disused:amenity": "bicycle_rental"},
+            )
+    return nodes + ways
+
+
+def measure(function: Callable[[], object], repeat: int) -> float:
+    """Best of repeat runs, in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _forgetNames(report: str):
+    """Names of each run are rated again, as on a first run"""
+    cacheNames.delete(("names", NAME_RATIO_VERSION, report))
+
+
+def _comparatorBenchmarks(
+    name: str,
+    comparator: Callable[[], Any],
+    data: list,
+    outputDirectory: Path,
+    repeat: int,
+) -> dict[str, float]:
+    validator = comparator()
+    results = {f"{name} pair": measure(lambda: comparator().pair(data), repeat)}
+    validator.pair(data)
+    outputPath = outputDirectory / f"benchmark-{name}.html"
+    mapPath = outputDirectory / f"map-benchmark-{name}.html"
+
+    def render():
+        _forgetNames(outputPath.stem)
+        validator.generateHtml(outputPath, mapPath, name)
+
+    results[f"{name} generateHtml"] = measure(render, repeat)
+    _forgetNames(outputPath.stem)
+    return results
+
+
+def runBenchmarks(size: str, repeat: int) -> dict[str, float]:
+    cities = syntheticStations(SIZES[size])
+    elements = overpassElements(cities)
+    overpassResult: OverpassResult = parseOverpassElements(elements)
+    mevoData = parseStations(stationInformationJSON(cities))
+    rooveeData = parsePlaces(bikesAndZonesJSON(cities))
+    results: dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        outputDirectory = Path(directory)
+        xmlPath = outputDirectory / "nextbike.xml.gz"
+        xmlPath.write_bytes(gzip.compress(nextbikeXML(cities)))
+        results["NextbikeParser"] = measure(
+            lambda: NP.NextbikeParser(path=xmlPath), repeat
+        )
+        nextbikeParser = NP.NextbikeParser(path=xmlPath)
+        nextbikeData = list(nextbikeParser.find_network(NETWORK_NAME))
+        results["parse overpass"] = measure(
+            lambda: parseOverpassElements(elements), repeat
+        )
+
+        comparators = [
+            ("nextbike", lambda: NextbikeValidator(nextbikeData, overpassResult)),
+            ("mevo", lambda: MevoComparator(MevoParser(), overpassResult)),
+            ("roovee", lambda: RooveeComparator(RooveeParser(), overpassResult)),
+        ]
+        data = {"nextbike": nextbikeData, "mevo": mevoData, "roovee": rooveeData}
+        for name, comparator in comparators:
+            results |= _comparatorBenchmarks(
+                name, comparator, data[name], outputDirectory, repeat
+            )
+
+        # Overpass result is served from cache, as the planner leaves it
+        request = nextbikeOverpassRequest(nextbikeData, NETWORK_NAME)
+        request.store(overpassResult)
+        outputPath = outputDirectory / "benchmark-run.html"
+
+        def run():
+            _forgetNames(outputPath.stem)
+            nextbike_run(
+                False,
+                NETWORK_NAME,
+                NETWORK_NAME,
+                outputPath,
+                nextbikeParser,
+                outputDirectory / "map-benchmark-run.html",
+            )
+
+        try:
+            results["nextbike_run"] = measure(run, repeat)
+        finally:
+            cacheOverpass.delete(request.cacheKey())
+            _forgetNames(outputPath.stem)
+    return results
+
+
+def compare(results: dict[str, float], baseline: dict[str, float]) -> bool:
+    """Prints results next to baseline, returns whether any regressed"""
+    regressed = False
+    for name, seconds in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:24} {seconds:9.4f}s")
+            continue
+        change = seconds / before - 1
+        flag = ""
+        if change > REGRESSION_THRESHOLD:
+            flag = " REGRESSION"
+            regressed = True
+        print(f"{name:24} {seconds:9.4f}s {before:9.4f}s {change:+7.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Times parsing, matching and rendering on synthetic data"
+    )
+    parser.add_argument("--size", choices=SIZES, default="region")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--save", metavar="NAME", help=f"store results in {benchmarksDirectory}"
+    )
+    parser.add_argument(
+        "--compare", metavar="NAME", help="baseline to compare results with"
+    )
+    args = parser.parse_args()
+    results = runBenchmarks(args.size, args.repeat)
+    baseline = {}
+    if args.compare is not None:
+        baselinePath = benchmarksDirectory / f"{args.compare}-{args.size}.json"
+        baseline = json.loads(baselinePath.read_text())["results"]
+    regressed = compare(results, baseline)
+    if args.save is not None:
+        benchmarksDirectory.mkdir(exist_ok=True)
+        (benchmarksDirectory / f"{args.save}-{args.size}.json").write_text(
+            json.dumps(
+                dict(
+                    python=platform.python_implementation()
+                    + " "
+                    + platform.python_version(),
+                    machine=platform.machine(),
+                    results=results,
+                ),
+                indent=2,
+            )
+        )
+    if regressed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import logging
+from collections.abc import Callable
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any
+
+from tqdm import tqdm
+
+from configuration import WORKERS
+
+
+class CityExecutor:
+    """Runs per-city compare and render jobs, in a process pool when workers > 1.
+    A failing job is logged and doesn't stop the others."""
+
+    def __init__(self, desc: str, workers: int = WORKERS):
+        self.desc = desc
+        self.pool = ProcessPoolExecutor(workers) if workers > 1 else None
+        self.jobs: list[tuple[str, Future]] = []
+        # Returned values by job name, None for failed jobs
+        self.results: dict[str, Any] = {}
+
+    def submit(self, name: str, function: Callable, /, *args, **kwargs):
+        if self.pool is None:
+            try:
+                self.results[name] = function(*args, **kwargs)
+            except Exception:
+                self.results[name] = None
+                logging.exception(f"{name} failed")
+        else:
+            self.jobs.append((name, self.pool.submit(function, *args, **kwargs)))
+
+    @property
+    def failed(self) -> list[str]:
+        return [name for name, result in self.results.items() if result is None]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self.pool is None:
+            return
+        for name, future in tqdm(self.jobs, desc=self.desc):
+            try:
+                self.results[name] = future.result()
+            except Exception:
+                self.results[name] = None
+                logging.exception(f"{name} failed")
+        self.pool.shutdown()
@@ -1,4 +1,18 @@
+import os
 from pathlib import Path
 
-cacheDirectory = Path("cache")
+__VERSION__ = "3.0.0"
+# Downloads, Overpass results, names, manifest and metrics, benchmarks use
+# a temporary one
+cacheDirectory = Path(os.environ.get("NEXTBIKEOSM_CACHE", "cache"))
 OVERPASS_URL = "https://overpass-api.de/api/interpreter"  # "http://localhost:12345/api/interpreter"
+OVERPASS_CACHE_TTL = 7 * 24 * 3600  # entries are dropped after a week
+OVERPASS_REFRESH_AGE = 20 * 3600  # older entries are queried again by the planner
+OVERPASS_CACHE_SIZE_LIMIT = 256 * 1024 * 1024  # least recently used are evicted
+GEODESK_PATH = Path("geodesk-data/poland.gol")
+OSM_SOURCE = "overpass"  # "geodesk" reads GEODESK_PATH instead of querying Overpass
+NEXTBIKE_COUNTRIES: list[str] | None = ["PL"]  # None processes every country
+MATCHING = "assignment"  # "nearest" matches each station independently
+WORKERS = 1  # > 1 compares and renders cities in a process pool
+INCREMENTAL = False  # skip cities whose inputs didn't change since the last run
+METRICS_PATH = cacheDirectory / "metrics.jsonl"  # stage durations and counters
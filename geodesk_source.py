@@ -1,32 +1,77 @@
-from geodesk import Box, Features
+from collections.abc import Iterable
+from functools import cache
+
+from geodesk import Box, Feature, Features
+from starsep_utils import Node, OverpassResult, Relation, Way
+from starsep_utils.overpass import KeyDict
+
+from configuration import GEODESK_PATH
+
+
+@cache
+def geodesk_library() -> Features:
+    """Opened once per run and shared by all cities"""
+    return Features(str(GEODESK_PATH))
+
+
+def _tags(feature: Feature) -> KeyDict:
+    return KeyDict({key: str(value) for key, value in feature.tags})
+
+
+def _toOverpassResult(features: Iterable[Feature]) -> OverpassResult:
+    nodes, ways, relations = {}, {}, {}
+    for feature in sorted(features, key=lambda feature: feature.id):
+        if feature.is_node:
+            nodes[feature.id] = Node(
+                id=feature.id,
+                type="node",
+                lat=feature.lat,
+                lon=feature.lon,
+                tags=_tags(feature),
+            )
+        elif feature.is_way:
+            # Only the centroid of a way is needed, it's stored as a negative
+            # id node, so Way.center works like for Overpass data
+            centroid = feature.centroid
+            nodes[-feature.id] = Node(
+                id=-feature.id,
+                type="node",
+                lat=centroid.lat,
+                lon=centroid.lon,
+                tags=KeyDict(),
+            )
+            ways[feature.id] = Way(
+                id=feature.id, type="way", nodes=[-feature.id], tags=_tags(feature)
+            )
+        else:
+            relations[feature.id] = Relation(
+                id=feature.id, type="relation", members=[], tags=_tags(feature)
+            )
+    return OverpassResult(
+        nodes=dict(sorted(nodes.items())), ways=ways, relations=relations
+    )
 
 
 def geodesk_bicycle_rentals(
     place_name: str,
     bbox: tuple[float, float, float, float],
     admin_level: int,
-):
-    library = Features("geodesk-data/poland.gol")
+) -> OverpassResult:
+    """Same features as overpass_parser.fetchOverpassData, read from GEODESK_PATH"""
+    library = geodesk_library()
     places = library(
         f'a[boundary=administrative][admin_level={admin_level}][name="{place_name}"]'
     )
-    if places.count == 0:
-        return
-    place = places.first
-    bicycle_rentals = library("*[amenity=bicycle_rental]")
-    disused_bicycle_rentals = library(
-        '*[amenity=bicycle_parking]["disused:amenity"=bicycle_rental]'
-    )
-    bicycle_rentals_in_place = bicycle_rentals.within(place)
-    disused_bicycle_rentals_in_place = disused_bicycle_rentals.within(place)
     (lat_min, lon_min, lat_max, lon_max) = bbox
     bounds = Box(west=lon_min, south=lat_min, east=lon_max, north=lat_max)
-    bicycle_rentals_in_bounds = bicycle_rentals(bounds)
-    disused_bicycle_rentals_in_bounds = disused_bicycle_rentals(bounds)
-    print(
-        place_name,
-        bicycle_rentals_in_place.count,
-        disused_bicycle_rentals_in_place.count,
-        bicycle_rentals_in_bounds.count,
-        disused_bicycle_rentals_in_bounds.count,
-    )
+    features: dict[tuple[str, int], Feature] = {}
+    for query in [
+        library("*[amenity=bicycle_rental]"),
+        library('*[amenity=bicycle_parking]["disused:amenity"=bicycle_rental]'),
+    ]:
+        matching = [query(bounds)]
+        if places.count > 0:
+            matching.append(query.within(places.first))
+        for feature in (feature for found in matching for feature in found):
+            features[(feature.osm_type, feature.id)] = feature
+    return _toOverpassResult(features.values())
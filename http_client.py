@@ -0,0 +1,147 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+from collections.abc import Coroutine
+from pathlib import Path
+from typing import Any, TypeVar
+from urllib.parse import urlsplit
+
+import httpx
+
+USER_AGENT = "starsep/NextbikeOSM"
+# Overpass queries run up to 250 seconds
+TIMEOUT = httpx.Timeout(300, connect=15)
+RETRIES = 3
+RETRY_BACKOFF = 5
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+HOST_CONCURRENCY = 4
+VALIDATOR_HEADERS = {"ETag": "If-None-Match", "Last-Modified": "If-Modified-Since"}
+
+T = TypeVar("T")
+
+# Shared by all fetches of a process, so pooled connections stay usable.
+# Created again in forked workers, which must not use sockets of the parent.
+_pid: int | None = None
+_loop: asyncio.AbstractEventLoop
+_client: httpx.AsyncClient | None = None
+_hostSemaphores: dict[str, asyncio.Semaphore] = {}
+
+
+def _ensureProcessState():
+    global _pid, _loop, _client, _hostSemaphores
+    if _pid == os.getpid():
+        return
+    # Inherited loop and client are dropped, not closed, as closing them
+    # would close connections the parent still uses
+    _pid = os.getpid()
+    _loop = asyncio.new_event_loop()
+    _client = None
+    _hostSemaphores = {}
+
+
+def run(coroutine: Coroutine[Any, Any, T]) -> T:
+    """Runs coroutine on the event loop of the process."""
+    _ensureProcessState()
+    return _loop.run_until_complete(coroutine)
+
+
+def _getClient() -> httpx.AsyncClient:
+    global _client
+    _ensureProcessState()
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=TIMEOUT,
+            headers={"User-Agent": USER_AGENT},
+            follow_redirects=True,
+        )
+    return _client
+
+
+async def _checkStatus(response: httpx.Response) -> httpx.Response:
+    # 304 Not Modified is an answer to a conditional request, not an error
+    if response.status_code == httpx.codes.NOT_MODIFIED:
+        return response
+    try:
+        return response.raise_for_status()
+    except httpx.HTTPStatusError:
+        await response.aclose()
+        raise
+
+
+async def _send(method: str, url: str, stream: bool, **kwargs) -> httpx.Response:
+    client = _getClient()
+    return await client.send(client.build_request(method, url, **kwargs), stream=stream)
+
+
+async def request(
+    method: str, url: str, stream: bool = False, **kwargs
+) -> httpx.Response:
+    """Pooled request with at most HOST_CONCURRENCY requests per host at once.
+    Transport errors and RETRY_STATUS_CODES are retried with backoff.
+    A stream=True response has to be closed by the caller."""
+    host = urlsplit(url).hostname or ""
+    semaphore = _hostSemaphores.setdefault(host, asyncio.Semaphore(HOST_CONCURRENCY))
+    async with semaphore:
+        for attempt in range(RETRIES):
+            try:
+                response = await _send(method, url, stream, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return await _checkStatus(response)
+                await response.aclose()
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(RETRY_BACKOFF * 2**attempt)
+        response = await _send(method, url, stream, **kwargs)
+        return await _checkStatus(response)
+
+
+async def cachedDownload(url: str, path: Path, compress: bool = False, **kwargs):
+    """Streams GET body to path, gzip compressed if compress. ETag and
+    Last-Modified of the stored body are sent as validators, so it's kept
+    on 304 Not Modified. If the download fails, a stored body is kept too."""
+    try:
+        await _download(url, path, compress, **kwargs)
+    except httpx.HTTPError:
+        if not path.exists():
+            raise
+        logging.exception(f"Downloading {url} failed, using cached {path}")
+
+
+async def _download(url: str, path: Path, compress: bool, **kwargs):
+    validatorsPath = path.with_name(f"{path.name}.validators.json")
+    validators = {}
+    if path.exists() and validatorsPath.exists():
+        validators = json.loads(validatorsPath.read_text())
+    headers = dict(kwargs.pop("headers", {}))
+    if validators.get("url") == url:
+        for header, conditional in VALIDATOR_HEADERS.items():
+            if header in validators:
+                headers[conditional] = validators[header]
+    response = await request("GET", url, stream=True, headers=headers, **kwargs)
+    try:
+        if response.status_code == httpx.codes.NOT_MODIFIED:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partPath = path.with_name(f"{path.name}.part")
+        opener = gzip.open if compress else open
+        with opener(partPath, "wb") as f:
+            async for chunk in response.aiter_bytes():
+                f.write(chunk)
+        # Validators are written last, so they never describe another body
+        validatorsPath.unlink(missing_ok=True)
+        partPath.replace(path)
+    finally:
+        await response.aclose()
+    validators = {"url": url}
+    for header in VALIDATOR_HEADERS:
+        if header in response.headers:
+            validators[header] = response.headers[header]
+    validatorsPath.write_text(json.dumps(validators))
+
+
+async def cachedGet(url: str, path: Path, **kwargs) -> bytes:
+    """cachedDownload returning the body"""
+    await cachedDownload(url, path, **kwargs)
+    return path.read_bytes()
@@ -0,0 +1,18 @@
+from functools import cache
+
+from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader
+
+from configuration import cacheDirectory
+
+bytecodeCacheDirectory = cacheDirectory / "jinja"
+
+
+@cache
+def jinjaEnvironment() -> Environment:
+    """Shared by all generators of a process. Compiled templates are kept in
+    bytecodeCacheDirectory, until template source changes."""
+    bytecodeCacheDirectory.mkdir(parents=True, exist_ok=True)
+    return Environment(
+        loader=PackageLoader("jinja_environment", "templates"),
+        bytecode_cache=FileSystemBytecodeCache(str(bytecodeCacheDirectory)),
+    )
@@ -1,133 +1,303 @@
 #!/usr/bin/env -S uv run python
+import argparse
+import asyncio
 import logging
 import shutil
-from os import name
+import time
+from functools import partial
 from pathlib import Path
 
-from jinja2 import Environment, PackageLoader
 from slugify import slugify
 from starsep_utils import healthchecks
-from tqdm import tqdm
 
-from mevo_comparator import mevo_run
-from mevo_parser import MevoParser
+import http_client
+from city_executor import CityExecutor
+from configuration import NEXTBIKE_COUNTRIES, cacheDirectory
+from jinja_environment import jinjaEnvironment
+from manifest import Manifest
+from metrics import labelled, providerHealthcheck, record, span
+from mevo_comparator import mevo_run, mevoOverpassRequest
+from mevo_parser import MevoParser, Station
 from nextbike_parser import NextbikeParser
-from nextbike_valid import nextbike_run
-from roovee_comparator import roovee_run
-from roovee_parser import RooveeNetwork, RooveeParser
+from nextbike_shards import NextbikeCity, Shard, mergeIndexes
+from nextbike_valid import nextbike_compare, nextbikeOverpassRequest
+from overpass_planner import OverpassPlanner
+from roovee_comparator import roovee_run, rooveeOverpassRequest
+from roovee_parser import Place, RooveeNetwork, RooveeParser
 
 templatesDirectory = Path("templates")
 libsDirectory = Path("libs")
 staticDirectory = Path("static")
 outputDirectory = Path("output")
+# Linked from Nextbike index pages, index.html lists Nextbike cities
+PROVIDER_INDEXES = [("Mevo", "mevo"), ("Roovee", "index-roovee")]
 
 
-def nextbike_main():
-    nextbikeParser = NextbikeParser()
-    networksPoland = []
-    for country in nextbikeParser.countries:
-        if country.countryCode == "PL":
-            for city in country.cities:
-                if len(city.places) > 0:
-                    networksPoland.append((city.uid, city.name.removesuffix(" (RL)")))
-    for networkId, cityName in tqdm(networksPoland, desc="Processing Nextbike"):
-        slug = slugify(cityName)
-        nextbike_run(
-            update=False,
-            network=str(networkId),
-            cityName=cityName,
-            outputPath=outputDirectory / f"{slug}.html",
-            mapPath=outputDirectory / f"map-{slug}.html",
-            nextbikeParser=nextbikeParser,
-        )
+async def nextbike_prepare(
+    planner: OverpassPlanner, countries: list[str] | None, shard: Shard
+):
+    with labelled(provider="nextbike"):
+        with span("download"):
+            await NextbikeParser.download()
+        with span("parse"):
+            nextbikeParser = await asyncio.to_thread(
+                NextbikeParser, countryCodes=countries
+            )
+    cities = []
+    for countryCode in countries or sorted(nextbikeParser.citiesByCountry):
+        for city in nextbikeParser.find_country_cities(countryCode):
+            nextbikeCity = NextbikeCity(
+                uid=city.uid,
+                name=city.name.removesuffix(" (RL)"),
+                countryCode=countryCode,
+            )
+            if len(city.places) > 0 and shard.contains(nextbikeCity):
+                cities.append(nextbikeCity)
+                planner.add(nextbikeOverpassRequest(city.places, nextbikeCity.name))
+    return nextbikeParser, cities
 
-    environment = Environment(loader=PackageLoader("nextbike_valid", "templates"))
-    template = environment.get_template("index.html")
-    cities = sorted(
-        [(cityName, slugify(cityName)) for (_, cityName) in networksPoland],
-        key=lambda x: x[0],
+
+def nextbike_main(
+    manifest: Manifest,
+    nextbikeParser: NextbikeParser,
+    cities: list[NextbikeCity],
+    shard: Shard,
+) -> list[str]:
+    with CityExecutor(desc="Processing Nextbike") as executor:
+        for city in cities:
+            executor.submit(
+                city.key,
+                nextbike_compare,
+                nextbikeData=nextbikeParser.find_city(city.uid),
+                cityName=city.name,
+                outputPath=outputDirectory / f"{city.slug}.html",
+                mapPath=outputDirectory / f"map-{city.slug}.html",
+                previousDigest=manifest.previous(f"nextbike:{city.key}"),
+            )
+    manifest.update(
+        {f"nextbike:{key}": digest for key, digest in executor.results.items()}
     )
-    with (outputDirectory / "index.html").open("w", encoding="utf-8") as f:
-        f.write(template.render(dict(cities=cities)))
+    # Failed cities have no page to link to
+    failed = set(executor.failed)
+    shard.writeListing(
+        outputDirectory, [city for city in cities if city.key not in failed]
+    )
+    # Sharded runs are merged by `main.py --merge N` once all of them finished
+    if shard.count == 1:
+        mergeIndexes(outputDirectory, 1, PROVIDER_INDEXES)
+    return executor.failed
 
 
-def mevo_main():
+async def mevo_prepare(planner: OverpassPlanner):
     mevoParser = MevoParser()
-    mevo_run(
-        outputPath=outputDirectory / "mevo.html",
-        mapPath=outputDirectory / "map-mevo.html",
-        mevoParser=mevoParser,
-    )
+    with labelled(provider="mevo"):
+        mevoData = await mevoParser.fetchNetwork()
+    planner.add(mevoOverpassRequest(mevoData))
+    return mevoParser, mevoData
 
-    _environment = Environment(loader=PackageLoader("main", "templates"))
-
-
-# TODO: GeoJSON output
-def roovee_main():
-    roovee_networks = [
-        RooveeNetwork(tenant="bikes", name="Szczecin"),
-        RooveeNetwork(tenant="brom", name="Bolesławiec"),
-        RooveeNetwork(tenant="chromek", name="Chodzież"),
-        RooveeNetwork(tenant="czeladz", name="Czeladź"),
-        RooveeNetwork(tenant="duszniki", name="Duszniki-Zdrój"),
-        RooveeNetwork(tenant="gliwice", name="Gliwice"),
-        RooveeNetwork(tenant="gniezno", name="Gniezno"),
-        # RooveeNetwork(tenant="grom", name="Giżycko"),
-        RooveeNetwork(tenant="kielce", name="Kielce"),
-        RooveeNetwork(tenant="krotower", name="Krotoszyn"),
-        RooveeNetwork(tenant="naklo", name="Nakło nad Notecią"),
-        RooveeNetwork(tenant="ndm", name="Nowy Dwór Mazowiecki"),
-        RooveeNetwork(tenant="olesnica", name="Oleśnica"),
-        RooveeNetwork(tenant="ostro", name="Ostrołęka"),
-        # RooveeNetwork(tenant="polkowice", name="Polkowice"),
-        RooveeNetwork(tenant="rawicz", name="Rawicz"),
-        RooveeNetwork(tenant="skarzysko", name="Skarżysko-Kamienna"),
-        RooveeNetwork(tenant="srm", name="Ścinawa"),
-        RooveeNetwork(tenant="suwalki", name="Suwałki"),
-        RooveeNetwork(tenant="swmr", name="Stalowa Wola"),
-        RooveeNetwork(tenant="suchylas", name="Suchy Las"),
-        RooveeNetwork(tenant="srem", name="Śrem"),
-        RooveeNetwork(tenant="wagrowiec", name="Wągrowiec"),
-        RooveeNetwork(tenant="zabrze", name="Zabrze"),
-        RooveeNetwork(tenant="zary", name="Żary"),
-        RooveeNetwork(tenant="zmigrod", name="Żmigród"),
-    ]
+
+def mevo_main(
+    manifest: Manifest, mevoParser: MevoParser, mevoData: list[Station]
+) -> list[str]:
+    with CityExecutor(desc="Processing Mevo", workers=1) as executor:
+        executor.submit(
+            "mevo",
+            mevo_run,
+            outputPath=outputDirectory / "mevo.html",
+            mapPath=outputDirectory / "map-mevo.html",
+            mevoParser=mevoParser,
+            mevoData=mevoData,
+            previousDigest=manifest.previous("mevo"),
+        )
+    manifest.update(executor.results)
+    return executor.failed
+
+
+ROOVEE_NETWORKS = [
+    RooveeNetwork(tenant="bikes", name="Szczecin"),
+    RooveeNetwork(tenant="brom", name="Bolesławiec"),
+    RooveeNetwork(tenant="chromek", name="Chodzież"),
+    RooveeNetwork(tenant="czeladz", name="Czeladź"),
+    RooveeNetwork(tenant="duszniki", name="Duszniki-Zdrój"),
+    RooveeNetwork(tenant="gliwice", name="Gliwice"),
+    RooveeNetwork(tenant="gniezno", name="Gniezno"),
+    # RooveeNetwork(tenant="grom", name="Giżycko"),
+    RooveeNetwork(tenant="kielce", name="Kielce"),
+    RooveeNetwork(tenant="krotower", name="Krotoszyn"),
+    RooveeNetwork(tenant="naklo", name="Nakło nad Notecią"),
+    RooveeNetwork(tenant="ndm", name="Nowy Dwór Mazowiecki"),
+    RooveeNetwork(tenant="olesnica", name="Oleśnica"),
+    RooveeNetwork(tenant="ostro", name="Ostrołęka"),
+    # RooveeNetwork(tenant="polkowice", name="Polkowice"),
+    RooveeNetwork(tenant="rawicz", name="Rawicz"),
+    RooveeNetwork(tenant="skarzysko", name="Skarżysko-Kamienna"),
+    RooveeNetwork(tenant="srm", name="Ścinawa"),
+    RooveeNetwork(tenant="suwalki", name="Suwałki"),
+    RooveeNetwork(tenant="swmr", name="Stalowa Wola"),
+    RooveeNetwork(tenant="suchylas", name="Suchy Las"),
+    RooveeNetwork(tenant="srem", name="Śrem"),
+    RooveeNetwork(tenant="wagrowiec", name="Wągrowiec"),
+    RooveeNetwork(tenant="zabrze", name="Zabrze"),
+    RooveeNetwork(tenant="zary", name="Żary"),
+    RooveeNetwork(tenant="zmigrod", name="Żmigród"),
+]
+
+
+async def roovee_prepare(planner: OverpassPlanner):
     rooveeParser = RooveeParser()
-    for network in tqdm(roovee_networks, desc="Processing Roovee"):
-        slug = slugify(network.name)
-        roovee_run(
-            network=network,
-            outputPath=outputDirectory / f"{slug}.html",
-            mapPath=outputDirectory / f"map-{slug}.html",
-            rooveeParser=rooveeParser,
+    with labelled(provider="roovee"):
+        networksData = await asyncio.gather(
+            *(rooveeParser.fetchNetwork(network) for network in ROOVEE_NETWORKS)
         )
+    rooveeData = {}
+    for network, data in zip(ROOVEE_NETWORKS, networksData, strict=True):
+        rooveeData[network.tenant] = data
+        planner.add(rooveeOverpassRequest(network, data))
+    return rooveeParser, rooveeData
+
+
+def roovee_main(
+    manifest: Manifest,
+    rooveeParser: RooveeParser,
+    rooveeData: dict[str, list[Place]],
+) -> list[str]:
+    with CityExecutor(desc="Processing Roovee") as executor:
+        for network in ROOVEE_NETWORKS:
+            slug = slugify(network.name)
+            executor.submit(
+                network.name,
+                roovee_run,
+                network=network,
+                outputPath=outputDirectory / f"{slug}.html",
+                mapPath=outputDirectory / f"map-{slug}.html",
+                rooveeParser=rooveeParser,
+                rooveeData=rooveeData[network.tenant],
+                previousDigest=manifest.previous(f"roovee:{network.tenant}"),
+            )
+    manifest.update(
+        {
+            f"roovee:{network.tenant}": executor.results.get(network.name)
+            for network in ROOVEE_NETWORKS
+        }
+    )
 
-    environment = Environment(loader=PackageLoader("main", "templates"))
-    template = environment.get_template("index.html")
+    template = jinjaEnvironment().get_template("index.html")
     cities = sorted(
-        [(network.name, slugify(network.name)) for network in roovee_networks],
+        [(network.name, slugify(network.name)) for network in ROOVEE_NETWORKS],
         key=lambda x: x[0],
     )
-    with (outputDirectory / "index.html").open("w", encoding="utf-8") as f:
+    with (outputDirectory / "index-roovee.html").open("w", encoding="utf-8") as f:
         f.write(template.render(dict(cities=cities)))
+    return executor.failed
+
+
+def finishProvider(provider: str, seconds: float, failed: list[str]):
+    """Records duration of provider and pings its healthcheck. It's the time
+    of its own prepare and run, without other providers and Overpass fetch."""
+    record(
+        stage="provider",
+        provider=provider.lower(),
+        seconds=round(seconds, 3),
+        failed=len(failed) > 0,
+    )
+    body = f"{seconds:.0f} s"
+    if failed:
+        body += f", failed: {', '.join(failed)}"
+    providerHealthcheck(provider, "/fail" if failed else "", body)
+
+
+async def prepareProviders(
+    providers, planner: OverpassPlanner, seconds: dict[str, float]
+) -> list:
+    """Downloads provider feeds concurrently, failures are returned.
+    Duration of each prepare is stored in seconds."""
+
+    async def timed(provider: str, prepare):
+        started = time.perf_counter()
+        try:
+            return await prepare(planner)
+        finally:
+            seconds[provider] = time.perf_counter() - started
+
+    return await asyncio.gather(
+        *(timed(provider, prepare) for provider, prepare, _ in providers),
+        return_exceptions=True,
+    )
+
+
+def parseArguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compares bike sharing networks with OpenStreetMap"
+    )
+    parser.add_argument(
+        "--countries",
+        type=lambda value: None if value.lower() == "all" else value.upper().split(","),
+        default=NEXTBIKE_COUNTRIES,
+        help='comma separated codes of Nextbike countries or "all"',
+    )
+    parser.add_argument(
+        "--shard",
+        type=Shard.parse,
+        default=Shard(1, 1),
+        metavar="I/N",
+        help="process I-th of N parts of Nextbike cities, Mevo and Roovee in 1/N",
+    )
+    parser.add_argument(
+        "--merge",
+        type=int,
+        metavar="N",
+        help="only write Nextbike index pages from outputs of N shards",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    healthchecks("/start")  # TODO: multiple healthchecks?
+    arguments = parseArguments()
+    if arguments.merge is not None:
+        mergeIndexes(outputDirectory, arguments.merge, PROVIDER_INDEXES)
+        raise SystemExit
+    healthchecks("/start")
     outputDirectory.mkdir(exist_ok=True)
     shutil.copy(templatesDirectory / "index.js", outputDirectory / "index.js")
     shutil.copy(libsDirectory / "sorttable.js", outputDirectory / "sorttable.js")
     shutil.copy(staticDirectory / "josm.svg", outputDirectory / "josm.svg")
-    try:
-        nextbike_main()
-    except Exception:
-        logging.exception("Nextbike failed")
-    try:
-        mevo_main()
-    except Exception:
-        logging.exception("Mevo failed")
-    try:
-        roovee_main()
-    except Exception:
-        logging.exception("Roovee failed")
+    shard = arguments.shard
+    providers = [
+        (
+            "Nextbike",
+            partial(nextbike_prepare, countries=arguments.countries, shard=shard),
+            partial(nextbike_main, shard=shard),
+        )
+    ]
+    if shard.index == 1:
+        providers += [
+            ("Mevo", mevo_prepare, mevo_main),
+            ("Roovee", roovee_prepare, roovee_main),
+        ]
+    planner = OverpassPlanner()
+    manifest = Manifest(cacheDirectory / "manifest.json")
+    prepared = {}
+    seconds: dict[str, float] = {}
+    for provider, _, _ in providers:
+        providerHealthcheck(provider, "/start")
+    results = http_client.run(prepareProviders(providers, planner, seconds))
+    for (provider, _, _), result in zip(providers, results, strict=True):
+        if isinstance(result, BaseException):
+            logging.error(f"{provider} failed", exc_info=result)
+            finishProvider(provider, seconds[provider], [provider])
+        else:
+            prepared[provider] = result
+    with span("overpass"):
+        planner.fetch()
+    for provider, _, run in providers:
+        if provider not in prepared:
+            continue
+        started = time.perf_counter()
+        try:
+            failed = run(manifest, *prepared[provider])
+        except Exception:
+            logging.exception(f"{provider} failed")
+            failed = [provider]
+        seconds[provider] += time.perf_counter() - started
+        finishProvider(provider, seconds[provider], failed)
     healthchecks()
@@ -0,0 +1,71 @@
+import dataclasses
+import hashlib
+import json
+from functools import cache
+from pathlib import Path
+
+from starsep_utils import Element, Node, OverpassResult, Relation, Way
+
+from configuration import __VERSION__, INCREMENTAL
+
+templatesDirectory = Path(__file__).parent / "templates"
+
+
+@cache
+def _templatesDigest() -> str:
+    digest = hashlib.sha256()
+    for path in sorted(templatesDirectory.iterdir()):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _elementJSON(element: Element) -> list:
+    result = [element.type, element.id, sorted(element.tags.items())]
+    if type(element) is Node:
+        result += [element.lat, element.lon]
+    elif type(element) is Way:
+        result.append(element.nodes)
+    elif type(element) is Relation:
+        result.append([[m.type, m.id, m.role] for m in element.members])
+    return result
+
+
+def inputsDigest(stations: list, overpassResult: OverpassResult) -> str:
+    """Hash of everything a city's output depends on"""
+    digest = hashlib.sha256()
+    digest.update(__VERSION__.encode())
+    digest.update(_templatesDigest().encode())
+    for station in stations:
+        digest.update(
+            json.dumps(
+                dataclasses.asdict(station), sort_keys=True, default=str
+            ).encode()
+        )
+    for element in overpassResult.allElements():
+        digest.update(json.dumps(_elementJSON(element), default=str).encode())
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Input digests of generated cities, kept between runs"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.digests: dict[str, str] = (
+            json.loads(path.read_text()) if path.exists() else {}
+        )
+
+    def previous(self, key: str) -> str | None:
+        """Digest to pass to a compare function, None forces regeneration"""
+        return self.digests.get(key) if INCREMENTAL else None
+
+    def update(self, digests: dict[str, str | None]):
+        """None marks a failed city, so it's regenerated next time"""
+        for key, digest in digests.items():
+            if digest is None:
+                self.digests.pop(key, None)
+            else:
+                self.digests[key] = digest
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.digests, indent=2, sort_keys=True))
@@ -0,0 +1,68 @@
+import json
+import logging
+import os
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+
+from configuration import METRICS_PATH
+
+# Set by the first process of a run, inherited by its worker processes
+RUN = os.environ.setdefault("NEXTBIKEOSM_RUN", time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+_labels: ContextVar[dict[str, str] | None] = ContextVar("labels", default=None)
+
+
+@contextmanager
+def labelled(**labels: str) -> Iterator[None]:
+    """Adds labels to metrics recorded inside, like provider and city"""
+    token = _labels.set((_labels.get() or {}) | labels)
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def record(**fields):
+    """Appends a JSON line to METRICS_PATH. Lines are short and appended with
+    a single write, so worker processes don't interleave them."""
+    line = json.dumps(
+        {"run": RUN, "time": round(time.time(), 3), **(_labels.get() or {}), **fields},
+        ensure_ascii=False,
+    )
+    METRICS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with METRICS_PATH.open("a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Records duration of stage, also when it fails"""
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        record(
+            stage=stage, seconds=round(time.perf_counter() - start, 6), failed=failed
+        )
+
+
+def count(counter: str, **fields):
+    record(counter=counter, **fields)
+
+
+def providerHealthcheck(provider: str, suffix: str = "", body: str = ""):
+    """Pings HEALTHCHECKS_URL_<PROVIDER>, so each provider has its own check.
+    /start, then "" or /fail, lets healthchecks measure its duration."""
+    url = os.environ.get(f"HEALTHCHECKS_URL_{provider.upper()}")
+    if url is None:
+        return
+    try:
+        httpx.post(url + suffix, content=body.encode())
+    except httpx.HTTPError:
+        logging.exception(f"{provider} healthcheck failed")
@@ -1,21 +1,24 @@
 import dataclasses
-import difflib as SC
-import json
 import urllib.parse
 from dataclasses import dataclass
 from pathlib import Path
 from time import localtime, strftime
 
-from jinja2 import Environment, PackageLoader
-from starsep_utils import Element, GeoPoint, OverpassResult, Way, haversine
+import geojson
+from starsep_utils import Element, GeoPoint, OverpassResult, Way
 
+from jinja_environment import jinjaEnvironment
+from manifest import inputsDigest
+from metrics import labelled, span
 from mevo_parser import MevoParser, Station
-from overpass_parser import fetchOverpassData
+from osm_index import CentroidTable
+from overpass_parser import OverpassRequest
+from report_writer import FeatureWriter, pointFeature, reportExists
+from station_matcher import DISTANCE_THRESHOLD_MISMATCH, StationMatcher
 
-DISTANCE_THRESHOLD_MISMATCH = 100
-MAX_DISTANCE = 1000000
 OSM_URL = "https://osm.org"
 JOSM_URL = "http://localhost:8111"
+MEVO_AREA_NAME = "województwo pomorskie"
 
 
 def mevoNetworkTags():
@@ -38,8 +41,25 @@ class Match:
     place: Station
     osm: Element
     osmType: str
+    matchedBy: str
     ratio: float = 0.0
 
+    def toGeoJSON(self) -> geojson.Feature:
+        return pointFeature(
+            self.place.lat,
+            self.place.lon,
+            dict(
+                name=self.place.name,
+                ref=self.place.ref,
+                capacity=self.place.capacity,
+                osm=f"{self.osmType}/{self.osm.id}",
+                distance=self.distance,
+                matchedBy=self.matchedBy,
+                nameRatio=self.ratio,
+                mismatch=self.distance > DISTANCE_THRESHOLD_MISMATCH,
+            ),
+        )
+
     @property
     def osmMarkLink(self):
         return f"{OSM_URL}?mlat={self.place.lat}&mlon={self.place.lon}#map=19/{self.place.lat}/{self.place.lon}"
@@ -125,107 +145,85 @@ class MapFeature(GeoPoint):
         return f"{self.lat},{self.lon},addNode " + self.tags.toCSV()
 
 
+def _osmName(element: Element) -> str | None:
+    name = element.tags.get("name")
+    if name is not None:
+        name = name.replace("MEVO ", "")
+    return name
+
+
+def _isBicycleRentalOrDisused(element: Element) -> bool:
+    if "amenity" not in element.tags:
+        return False
+    if element.tags["amenity"] not in ["bicycle_rental", "bicycle_parking"]:
+        return False
+    if element.tags["amenity"] == "bicycle_parking" and (
+        "disused:amenity" not in element.tags
+        or element.tags["disused:amenity"] != "bicycle_rental"
+    ):
+        return False
+    return True
+
+
 class MevoComparator:
     def __init__(self, data, overpassResult: OverpassResult, html=None):
         self.data = data
         self.overpassResult = overpassResult
         self.matches: list[Match] = []
         self.html = html
-        self.envir = Environment(loader=PackageLoader("mevo_comparator", "templates"))
-
-    def matchViaDistance(self, place: Station) -> tuple[Element | None, float]:
-        bestDistance = MAX_DISTANCE
-        best: Element | None = None
-
-        for element in self.overpassResult.allElements():
-            if "amenity" not in element.tags:
-                continue
-            if element.tags["amenity"] not in ["bicycle_rental", "bicycle_parking"]:
-                continue
-            if element.tags["amenity"] == "bicycle_parking" and (
-                "disused:amenity" not in element.tags
-                or element.tags["disused:amenity"] != "bicycle_rental"
-            ):
-                continue
-            point = element.center(self.overpassResult)
-            dist = haversine(place, point)
-            if dist < bestDistance:
-                bestDistance = dist
-                best = element
-        return best, bestDistance
+        self.envir = jinjaEnvironment()
+        self.centroids = CentroidTable(overpassResult)
+        self.matcher = StationMatcher(
+            self.centroids, _isBicycleRentalOrDisused, _osmName
+        )
 
     def pair(self, places: list[Station]):
-        data = []
-        for place in places:
-            matchedElement, dist = self.matchViaDistance(place)
-            data.append(
-                Match(
-                    distance=dist,
-                    place=place,
-                    osm=matchedElement,
-                    osmType="way" if type(matchedElement) is Way else "node",
-                )
+        self.matches = [
+            Match(
+                distance=dist,
+                place=place,
+                osm=element,
+                osmType="way" if type(element) is Way else "node",
+                matchedBy=matchedBy,
+            )
+            for place, (element, dist, matchedBy) in zip(
+                places, self.matcher.match(places), strict=True
             )
-        self.matches = data
+        ]
 
     def generateHtml(self, outputPath: Path, mapPath: Path, cityName: str):
         timestamp = strftime("%a, %d %b @ %H:%M:%S", localtime())
         template = self.envir.get_template("mevo.html")
-        matches = []
-        for match in self.matches:
-            match.ratio = (
-                SC.SequenceMatcher(
-                    None,
-                    match.place.name,
-                    match.osm.tags.get("name").replace("MEVO ", ""),
-                ).ratio()
-                if match.osm.tags.get("name") is not None
-                else 0
-            )
-            matches.append(match)
         csvPath = outputPath.with_suffix(".csv")
         kmlPath = outputPath.with_suffix(".kml")
-        mismatches = list(
-            filter(lambda m: m.distance > DISTANCE_THRESHOLD_MISMATCH, matches)
-        )
-        mapFeatures = list(map(MapFeature.fromMatch(mevoNetworkTags()), mismatches))
-        with outputPath.open("w", encoding="utf-8") as f:
+        geojsonPath = outputPath.with_suffix(".geojson")
+        with (
+            FeatureWriter(
+                mapPath, csvPath, kmlPath, geojsonPath, cityName, dataclasses.asdict
+            ) as features,
+            outputPath.open("w", encoding="utf-8") as f,
+        ):
             context = {
-                "matches": matches,
+                "matches": self.matcher.reported(
+                    self.matches,
+                    lambda match: match.place.name,
+                    outputPath.stem,
+                    features,
+                    MapFeature.fromMatch(mevoNetworkTags()),
+                ),
                 "timestamp": timestamp,
-                "countMismatches": len(mapFeatures),
+                "countMismatches": sum(
+                    match.distance > DISTANCE_THRESHOLD_MISMATCH
+                    for match in self.matches
+                ),
                 "distanceThreshold": DISTANCE_THRESHOLD_MISMATCH,
                 "cityName": cityName,
                 "mapLink": str(mapPath.name),
                 "csvLink": str(csvPath.name),
                 "kmlLink": str(kmlPath.name),
+                "geojsonLink": str(geojsonPath.name),
             }
-            f.write(template.render(context))
-        self.generateMap(mapPath, mapFeatures, cityName)
-        self.generateCSV(csvPath, mapFeatures)
-        self.generateKML(kmlPath, mapFeatures)
-
-    def generateMap(self, mapPath: Path, mapFeatures: list[MapFeature], cityName: str):
-        mapFeaturesDict = list(map(dataclasses.asdict, mapFeatures))
-        mapTemplate = self.envir.get_template("map.html")
-        with mapPath.open("w", encoding="utf-8") as f:
-            context = {
-                "featuresJson": json.dumps(mapFeaturesDict),
-                "cityName": cityName,
-            }
-            f.write(mapTemplate.render(context))
-
-    @staticmethod
-    def generateCSV(csvPath: Path, mapFeatures: list[MapFeature]):
-        with csvPath.open("w") as f:
-            for feature in mapFeatures:
-                f.write(feature.toCSV() + "\n")
-
-    def generateKML(self, kmlPath: Path, mapFeatures: list[MapFeature]):
-        kmlTemplate = self.envir.get_template("station.kml")
-        with kmlPath.open("w", encoding="utf-8") as f:
-            context = {"features": mapFeatures}
-            f.write(kmlTemplate.render(context))
+            f.writelines(template.generate(context))
 
     def containsData(self, path: Path):
         timek = strftime("%a, %d %b @ %H:%M:%S", localtime())
@@ -251,17 +249,32 @@ def _calculateBbox(data: list[Station]) -> tuple[float, float, float, float]:
     )
 
 
+def mevoOverpassRequest(mevoData: list[Station]) -> OverpassRequest:
+    return OverpassRequest(
+        placeName=MEVO_AREA_NAME, bbox=_calculateBbox(mevoData), admin_level=4
+    )
+
+
 def mevo_run(
     outputPath: Path,
     mevoParser: MevoParser,
     mapPath: Path | None = None,
-):
-    mevoData = mevoParser.downloadNetwork()
-    name = "województwo pomorskie"
-    overpassResult = fetchOverpassData(
-        placeName=name, bbox=_calculateBbox(mevoData), admin_level=4
-    )
-    validator = MevoComparator(mevoParser, overpassResult)
-    if validator.containsData(outputPath):
-        validator.pair(mevoData)
-        validator.generateHtml(outputPath, mapPath, name)
+    mevoData: list[Station] | None = None,
+    previousDigest: str | None = None,
+) -> str:
+    name = MEVO_AREA_NAME
+    with labelled(provider="mevo", city=name):
+        if mevoData is None:
+            mevoData = mevoParser.downloadNetwork()
+        with span("overpass"):
+            overpassResult = mevoOverpassRequest(mevoData).fetch()
+        digest = inputsDigest(mevoData, overpassResult)
+        if digest == previousDigest and reportExists(outputPath, mapPath):
+            return digest
+        validator = MevoComparator(mevoParser, overpassResult)
+        if validator.containsData(outputPath):
+            with span("pair"):
+                validator.pair(mevoData)
+            with span("render"):
+                validator.generateHtml(outputPath, mapPath, name)
+        return digest
@@ -1,11 +1,19 @@
+import json
 from dataclasses import dataclass
 
-import httpx
-from starsep_utils import GeoPoint
+import http_client
+from configuration import cacheDirectory
+from metrics import span
 
+mevoFilePath = cacheDirectory / "mevo" / "station_information.json"
 
-@dataclass(frozen=True)
-class Station(GeoPoint):
+
+@dataclass(frozen=True, slots=True)
+class Station:
+    """Like a GeoPoint, but slotted"""
+
+    lat: float
+    lon: float
     name: str
     ref: str
     capacity: int
@@ -13,22 +21,34 @@ class Station(GeoPoint):
 
 class MevoParser:
     def downloadNetwork(self) -> list[Station]:
+        return http_client.run(self.fetchNetwork())
+
+    async def fetchNetwork(self) -> list[Station]:
         # https://rowermevo.pl/open-data/realtime
-        data = httpx.get(
-            "https://gbfs.urbansharing.com/rowermevo.pl/station_information.json",
-            headers={"Client-Identifier": "starsep-mevoosm"},
-        ).json()
-        stations: list[Station] = []
-        for station in data["data"]["stations"]:
-            # if station["is_virtual_station"]:
-            #     continue
-            stations.append(
-                Station(
-                    name=station["name"],
-                    lat=station["lat"],
-                    lon=station["lon"],
-                    ref=station["station_id"],
-                    capacity=station["capacity"],
-                )
+        with span("download"):
+            content = await http_client.cachedGet(
+                "https://gbfs.urbansharing.com/rowermevo.pl/station_information.json",
+                mevoFilePath,
+                headers={"Client-Identifier": "starsep-mevoosm"},
+            )
+        with span("parse"):
+            return parseStations(content)
+
+
+def parseStations(content: bytes) -> list[Station]:
+    """Stations of GBFS station_information.json"""
+    data = json.loads(content)
+    stations: list[Station] = []
+    for station in data["data"]["stations"]:
+        # if station["is_virtual_station"]:
+        #     continue
+        stations.append(
+            Station(
+                name=station["name"],
+                lat=station["lat"],
+                lon=station["lon"],
+                ref=station["station_id"],
+                capacity=station["capacity"],
             )
-        return stations
+        )
+    return stations
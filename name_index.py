@@ -0,0 +1,139 @@
+import re
+from collections import defaultdict
+from collections.abc import Callable, Container
+from math import ceil, floor
+
+from starsep_utils import Element, GeoPoint, haversine
+
+from name_similarity import nameRatio, normalizeName
+from osm_index import CentroidTable
+from spatial_index import bboxMargins
+
+# Candidates share at least this fraction of trigrams of the searched name
+MIN_SHARED_TRIGRAMS = 0.5
+NAME_MIN_RATIO = 0.8
+NAME_MAX_DISTANCE = 2000
+# Score of a candidate is its name ratio minus this at NAME_MAX_DISTANCE
+DISTANCE_PENALTY = 0.5
+# Trigrams are indexed per cell, so only names around a station are compared
+NAME_CELL_SIZE = 0.05
+
+
+def trigrams(name: str) -> set[str]:
+    padded = f"  {normalizeName(name)} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _numbers(name: str) -> list[str]:
+    return re.findall(r"\d+", name)
+
+
+def _cell(lat: float, lon: float) -> tuple[int, int]:
+    return floor(lat / NAME_CELL_SIZE), floor(lon / NAME_CELL_SIZE)
+
+
+def elementName(element: Element) -> str | None:
+    return element.tags.get("name")
+
+
+class NameIndex:
+    """Trigram index over names of elements of a CentroidTable accepted by
+    predicate. Built once per OSM result, names are compared only with
+    elements sharing enough trigrams."""
+
+    def __init__(
+        self,
+        centroids: CentroidTable,
+        predicate: Callable[[Element], bool],
+        osmName: Callable[[Element], str | None] = elementName,
+    ):
+        self.centroids = centroids
+        self.names: dict[int, str] = {}
+        self.trigrams: dict[int, set[str]] = {}
+        self.cells: dict[tuple[int, int], dict[str, list[int]]] = defaultdict(
+            lambda: defaultdict(list)
+        )
+        for position, element in enumerate(centroids.elements):
+            name = osmName(element)
+            if name is None or not predicate(element):
+                continue
+            self.names[position] = name
+            self.trigrams[position] = trigrams(name)
+            postings = self.cells[
+                _cell(centroids.lats[position], centroids.lons[position])
+            ]
+            for trigram in self.trigrams[position]:
+                postings[trigram].append(position)
+
+    def _postingsAround(self, point: GeoPoint) -> list[dict[str, list[int]]]:
+        """Postings of cells containing every point within NAME_MAX_DISTANCE"""
+        margins = bboxMargins(point, NAME_MAX_DISTANCE)
+        if margins is None:
+            return list(self.cells.values())
+        dLat, dLon = margins
+        minLat, minLon = _cell(point.lat - dLat, point.lon - dLon)
+        maxLat, maxLon = _cell(point.lat + dLat, point.lon + dLon)
+        return [
+            self.cells[cell]
+            for cell in (
+                (cellLat, cellLon)
+                for cellLat in range(minLat, maxLat + 1)
+                for cellLon in range(minLon, maxLon + 1)
+            )
+            if cell in self.cells
+        ]
+
+    def candidates(self, name: str, point: GeoPoint | None = None) -> list[int]:
+        """Positions sharing at least MIN_SHARED_TRIGRAMS of trigrams of name,
+        only in cells around point if given."""
+        cells = (
+            list(self.cells.values()) if point is None else self._postingsAround(point)
+        )
+        query = trigrams(name)
+        needed = ceil(MIN_SHARED_TRIGRAMS * len(query))
+
+        def frequency(trigram: str) -> int:
+            return sum(len(postings.get(trigram, ())) for postings in cells)
+
+        # A candidate has at least one of the rarest len - needed + 1 trigrams
+        rarest = sorted(query, key=frequency)
+        found = {
+            position
+            for trigram in rarest[: len(query) - needed + 1]
+            for postings in cells
+            for position in postings.get(trigram, ())
+        }
+        return sorted(
+            position
+            for position in found
+            if len(query & self.trigrams[position]) >= needed
+        )
+
+    def nearest(
+        self, point: GeoPoint, name: str, excluded: Container[int] = ()
+    ) -> tuple[Element | None, float]:
+        """Element with best name ratio, penalized by distance. Only names
+        with NAME_MIN_RATIO and the same numbers within NAME_MAX_DISTANCE
+        are considered, positions in excluded are skipped."""
+        best = None
+        bestScore = float("-inf")
+        bestDistance = NAME_MAX_DISTANCE
+        numbers = _numbers(name)
+        for position in self.candidates(name, point):
+            if position in excluded:
+                continue
+            # Numbered stations with similar names are different stations
+            if _numbers(self.names[position]) != numbers:
+                continue
+            ratio = nameRatio(name, self.names[position])
+            if ratio < NAME_MIN_RATIO:
+                continue
+            distance = haversine(point, self.centroids.center(position))
+            if distance > NAME_MAX_DISTANCE:
+                continue
+            score = ratio - DISTANCE_PENALTY * distance / NAME_MAX_DISTANCE
+            if score > bestScore:
+                best = self.centroids.elements[position]
+                bestScore = score
+                bestDistance = distance
+        return best, bestDistance
@@ -0,0 +1,82 @@
+import time
+import unicodedata
+
+from diskcache import Cache
+
+from configuration import cacheDirectory
+from metrics import record
+
+cacheNames = Cache(str(cacheDirectory / "names"))
+# Part of cache keys, bumped when normalizeName or nameRatio change
+NAME_RATIO_VERSION = 1
+
+# Letters without a Unicode decomposition into base letter and diacritic
+_LETTERS = str.maketrans({"ł": "l", "đ": "d", "ø": "o", "ħ": "h"})
+
+
+def normalizeName(name: str) -> str:
+    """Casefolded, without diacritics, whitespace collapsed"""
+    decomposed = unicodedata.normalize("NFKD", name.casefold().translate(_LETTERS))
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.split())
+
+
+def lcsLength(a: str, b: str) -> int:
+    """Longest common subsequence, bit-parallel over characters of a"""
+    masks: dict[str, int] = {}
+    for i, c in enumerate(a):
+        masks[c] = masks.get(c, 0) | (1 << i)
+    full = (1 << len(a)) - 1
+    row = full
+    for c in b:
+        matches = row & masks.get(c, 0)
+        row = ((row + matches) | (row - matches)) & full
+    return len(a) - row.bit_count()
+
+
+def nameRatio(a: str, b: str) -> float:
+    """Like difflib.SequenceMatcher.ratio() of normalized names, but with
+    longest common subsequence instead of Ratcliff-Obershelp matching
+    blocks, so it's never lower."""
+    a, b = normalizeName(a), normalizeName(b)
+    if not a and not b:
+        return 1.0
+    return 2 * lcsLength(a, b) / (len(a) + len(b))
+
+
+class NameScores:
+    """nameRatio of name pairs of one report, kept between runs.
+    Pairs not asked for during a run are dropped on save."""
+
+    def __init__(self, report: str):
+        self.key = ("names", NAME_RATIO_VERSION, report)
+        self.cached: dict[tuple[str, str], float] = cacheNames.get(self.key, {})
+        self.scores: dict[tuple[str, str], float] = {}
+        self.computed = 0
+        self.seconds = 0.0
+
+    def ratio(self, providerName: str, osmName: str | None) -> float:
+        if osmName is None:
+            return 0
+        pair = (providerName, osmName)
+        score = self.scores.get(pair)
+        if score is None:
+            score = self.cached.get(pair)
+            if score is None:
+                start = time.perf_counter()
+                score = nameRatio(providerName, osmName)
+                self.seconds += time.perf_counter() - start
+                self.computed += 1
+            self.scores[pair] = score
+        return score
+
+    def save(self):
+        record(
+            stage="names",
+            seconds=round(self.seconds, 6),
+            failed=False,
+            computed=self.computed,
+            cached=len(self.scores) - self.computed,
+        )
+        if self.scores != self.cached:
+            cacheNames.set(self.key, self.scores)
@@ -1,25 +1,103 @@
+import gzip
+import sys
 import xml.etree.ElementTree as XML
+from array import array
+from collections.abc import Collection, Iterator, Sequence
 from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, overload
 
-import httpx
-from starsep_utils import GeoPoint
-
+import http_client
 from configuration import cacheDirectory
 
 
-@dataclass(frozen=True)
-class Place(GeoPoint):
+@dataclass(frozen=True, slots=True)
+class Place:
+    """Like a GeoPoint, but slotted, so the whole feed takes less memory"""
+
+    lat: float
+    lon: float
     uid: str
     name: str
     num: str
-    stands: str
+    stands: int | None
+
+
+class PlaceTable(Sequence[Place]):
+    """Places as columns, coordinates in float arrays and numbers interned,
+    as the whole feed has tens of thousands of them. Place objects are only
+    built when accessed, so iterate once and keep the result."""
+
+    def __init__(self):
+        self.lats = array("d")
+        self.lons = array("d")
+        self.uids: list[str] = []
+        self.names: list[str] = []
+        self.nums: list[str] = []
+        self.stands: list[int | None] = []
+
+    def append(self, place: Place):
+        self.lats.append(place.lat)
+        self.lons.append(place.lon)
+        self.uids.append(place.uid)
+        self.names.append(place.name)
+        self.nums.append(sys.intern(place.num))
+        self.stands.append(place.stands)
+
+    def extend(self, other: "PlaceTable"):
+        self.lats.extend(other.lats)
+        self.lons.extend(other.lons)
+        self.uids.extend(other.uids)
+        self.names.extend(other.names)
+        self.nums.extend(other.nums)
+        self.stands.extend(other.stands)
+
+    def __len__(self) -> int:
+        return len(self.uids)
+
+    @overload
+    def __getitem__(self, index: int) -> Place: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "PlaceTable": ...
+
+    def __getitem__(self, index: int | slice) -> "Place | PlaceTable":
+        if isinstance(index, slice):
+            table = PlaceTable()
+            table.lats = self.lats[index]
+            table.lons = self.lons[index]
+            table.uids = self.uids[index]
+            table.names = self.names[index]
+            table.nums = self.nums[index]
+            table.stands = self.stands[index]
+            return table
+        return Place(
+            lat=self.lats[index],
+            lon=self.lons[index],
+            uid=self.uids[index],
+            name=self.names[index],
+            num=self.nums[index],
+            stands=self.stands[index],
+        )
+
+    def __iter__(self) -> Iterator[Place]:
+        for row in zip(
+            self.lats,
+            self.lons,
+            self.uids,
+            self.names,
+            self.nums,
+            self.stands,
+            strict=True,
+        ):
+            yield Place(*row)
 
 
 @dataclass
 class City:
     uid: str
     name: str
-    places: list[Place]
+    places: PlaceTable
 
 
 @dataclass
@@ -29,93 +107,121 @@ class Network:
     cities: list[City]
 
 
-nextbikeFilePath = cacheDirectory / "nextbike.xml"
+nextbikeFilePath = cacheDirectory / "nextbike.xml.gz"
+
+
+singleBikePlaceTypes = ["12", "20", "22", "24"]
+
+
+def _parsePlace(place_attrib: dict[str, str], cityName: str) -> Place | None:
+    uid = place_attrib["uid"]
+    lat = float(place_attrib["lat"])
+    lon = float(place_attrib["lng"])
+    name = place_attrib["name"]
+    place_type = place_attrib["place_type"]
+    if name.startswith("BIKE") or place_type in singleBikePlaceTypes:
+        return None
+    num = place_attrib.get("number", "0")
+    stands = int(place_attrib["bike_racks"]) if "bike_racks" in place_attrib else None
+    if "terminal_type" in place_attrib:
+        terminal_type = place_attrib["terminal_type"]
+        if terminal_type == "sign" and stands is not None and cityName == "Warszawa":
+            # TODO: move logic somewhere else?
+            stands = stands * 2
+    return Place(uid=uid, lat=lat, lon=lon, name=name, num=num, stands=stands)
 
 
 class NextbikeParser:
-    def __init__(self):
-        url = "https://maps2.nextbike.net/maps/nextbike-official.xml"
-        if not nextbikeFilePath.exists():
-            response = httpx.get(url)
-            response.raise_for_status()
-            nextbikeFilePath.write_bytes(response.content)
+    def __init__(
+        self,
+        countryCodes: Collection[str] | None = None,
+        cityUids: Collection[str] | None = None,
+        path: Path = nextbikeFilePath,
+    ):
+        """Streams gzipped nextbike.xml at path keeping only networks from
+        countryCodes and cities from cityUids, None means no filtering."""
+        if path == nextbikeFilePath and not path.exists():
+            http_client.run(NextbikeParser.download())
+
+        self.citiesByUid: dict[str, City] = {}
+        self.citiesByNetwork: dict[str, list[City]] = {}
+        self.citiesByCountry: dict[str, list[City]] = {}
 
-        file = XML.parse(nextbikeFilePath)
-        root = file.getroot()
+        with gzip.open(path, "rb") as nextbikeFile:
+            self._parse(nextbikeFile, countryCodes, cityUids)
 
+    def _parse(
+        self,
+        nextbikeFile: IO[bytes],
+        countryCodes: Collection[str] | None,
+        cityUids: Collection[str] | None,
+    ):
         C_list = []
+        root = None
+        depth = 0
+        network: Network | None = None
+        city: City | None = None
 
-        singleBikePlaceTypes = ["12", "20", "22", "24"]
-
-        for network in root:
-            cities_list = []
-
-            networkName = network.attrib["name"]
-            countryCode = network.attrib["country"]
-
-            for city in network:
-                place_list = []
-
-                cityId = city.attrib["uid"]
-                cityName = city.attrib["name"]
-
-                for place in city:
-                    place_attrib = place.attrib
-                    uid = place_attrib["uid"]
-                    lat = float(place_attrib["lat"])
-                    lon = float(place_attrib["lng"])
-                    name = place_attrib["name"]
-                    place_type = place_attrib["place_type"]
-                    if name.startswith("BIKE") or place_type in singleBikePlaceTypes:
-                        continue
-                    num = place_attrib["number"] if "number" in place_attrib else 0
-                    stands = (
-                        int(place_attrib["bike_racks"])
-                        if "bike_racks" in place_attrib
-                        else "None"
-                    )
-                    if "terminal_type" in place_attrib:
-                        terminal_type = place_attrib["terminal_type"]
-                        if (
-                            terminal_type == "sign"
-                            and isinstance(stands, int)
-                            and cityName == "Warszawa"
-                        ):
-                            # TODO: move logic somewhere else?
-                            stands = stands * 2
-                    stands = str(stands)
-                    place_list.append(
-                        Place(
-                            uid=uid, lat=lat, lon=lon, name=name, num=num, stands=stands
-                        )
-                    )
-                # if countryCode == "PL" and len(place_list) > 0:
-                #     print(networkName, countryCode, cityId, cityName)
-                cities_list.append(City(cityId, cityName, place_list))
-            C_list.append(Network(networkName, countryCode, cities_list))
+        for event, element in XML.iterparse(nextbikeFile, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    root = element
+                elif depth == 2:
+                    countryCode = element.attrib["country"]
+                    if countryCodes is None or countryCode in countryCodes:
+                        network = Network(element.attrib["name"], countryCode, [])
+                elif depth == 3 and network is not None:
+                    cityId = element.attrib["uid"]
+                    if cityUids is None or cityId in cityUids:
+                        city = City(cityId, element.attrib["name"], PlaceTable())
+                continue
+            if depth == 4 and city is not None:
+                place = _parsePlace(element.attrib, city.name)
+                if place is not None:
+                    city.places.append(place)
+            elif depth == 3 and city is not None:
+                network.cities.append(city)
+                city = None
+            elif depth == 2:
+                if network is not None:
+                    C_list.append(network)
+                    self._indexNetwork(network)
+                    network = None
+                # Drop finished networks, so memory doesn't grow with the feed
+                root.clear()
+            element.clear()
+            depth -= 1
         self.countries = C_list
 
     def __str__(self):
         for i in self.countries:
             return i.name
 
+    def _indexNetwork(self, network: Network):
+        networkCities = self.citiesByNetwork.setdefault(network.name, [])
+        countryCities = self.citiesByCountry.setdefault(network.countryCode, [])
+        for city in network.cities:
+            self.citiesByUid.setdefault(city.uid, city)
+            networkCities.append(city)
+            countryCities.append(city)
+
     def find_network(self, name):
         """Returns data for whole network"""
-        db = []
-        for i in self.countries:
-            if i.name == name:
-                for city in i.cities:
-                    e = city.places
-                    db += e
-        return db
+        places = PlaceTable()
+        for city in self.citiesByNetwork.get(name, []):
+            places.extend(city.places)
+        return places
 
     def find_city(self, cityId: str):
         """Returns data for city only"""
-        for i in self.countries:
-            for city in i.cities:
-                if city.uid == cityId:
-                    e = city.places
-                    return e
+        city = self.citiesByUid.get(cityId)
+        if city is not None:
+            return city.places
+
+    def find_country_cities(self, countryCode: str) -> list[City]:
+        """Returns all cities of networks in country"""
+        return self.citiesByCountry.get(countryCode, [])
 
     def check_uids(self, new_uids):
         old_uids = []
@@ -164,9 +270,15 @@ class NextbikeParser:
             for i in uids:
                 f.write(f"{i}\n")
 
+    @staticmethod
+    async def download():
+        """Downloads nextbike.xml unless the cached one is still up to date"""
+        url = "https://maps2.nextbike.net/maps/nextbike-official.xml"
+        await http_client.cachedDownload(url, nextbikeFilePath, compress=True)
+
     @staticmethod
     def update():
         url = "https://maps2.nextbike.net/maps/nextbike-live.xml"
-        response = httpx.get(url)
-        response.raise_for_status()
-        nextbikeFilePath.write_bytes(response.content)
+        http_client.run(
+            http_client.cachedDownload(url, nextbikeFilePath, compress=True)
+        )
@@ -0,0 +1,113 @@
+import dataclasses
+import json
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+
+from slugify import slugify
+
+from jinja_environment import jinjaEnvironment
+from report_writer import mergeTiles, tilesDirectory, writeMap
+
+# Pages of cities in other countries are prefixed by their country code
+UNPREFIXED_COUNTRY = "PL"
+
+
+@dataclass(frozen=True)
+class NextbikeCity:
+    uid: str
+    name: str
+    countryCode: str
+
+    @property
+    def key(self) -> str:
+        # Names repeat, even within a country, uids don't
+        return self.uid
+
+    @property
+    def slug(self) -> str:
+        if self.countryCode == UNPREFIXED_COUNTRY:
+            return slugify(self.name)
+        return slugify(f"{self.countryCode} {self.name}")
+
+
+@dataclass(frozen=True)
+class Shard:
+    """index-th of count parts of Nextbike cities, counted from 1"""
+
+    index: int
+    count: int
+
+    @staticmethod
+    def parse(value: str) -> "Shard":
+        index, count = (int(part) for part in value.split("/"))
+        if not 1 <= index <= count:
+            raise ValueError(f"Invalid shard {value}")
+        return Shard(index, count)
+
+    def contains(self, city: NextbikeCity) -> bool:
+        # crc32 instead of hash(), so every machine splits cities the same way
+        return zlib.crc32(city.uid.encode()) % self.count == self.index - 1
+
+    def listingPath(self, directory: Path) -> Path:
+        return directory / f"nextbike-shard-{self.index}-of-{self.count}.json"
+
+    def writeListing(self, directory: Path, cities: list[NextbikeCity]):
+        """Cities of the shard, read by mergeIndexes"""
+        self.listingPath(directory).write_text(
+            json.dumps([dataclasses.asdict(city) for city in cities], indent=2)
+        )
+
+
+def _links(cities: list[NextbikeCity]) -> list[tuple[str, str]]:
+    return sorted([(city.name, city.slug) for city in cities], key=lambda x: x[0])
+
+
+def mergeIndexes(
+    directory: Path,
+    shardCount: int,
+    providers: list[tuple[str, str]] | None = None,
+):
+    """Writes index-<country>.html with a map of each country and index.html
+    of all cities from listings of shardCount shards in directory. Pages of
+    other providers, as (name, slug), are linked from all of them."""
+    cities: list[NextbikeCity] = []
+    for index in range(1, shardCount + 1):
+        path = Shard(index, shardCount).listingPath(directory)
+        if not path.exists():
+            raise FileNotFoundError(f"Missing shard {index}/{shardCount}: {path}")
+        cities += [NextbikeCity(**city) for city in json.loads(path.read_text())]
+    citiesByCountry: dict[str, list[NextbikeCity]] = defaultdict(list)
+    for city in cities:
+        citiesByCountry[city.countryCode].append(city)
+    countries = [(code, f"index-{code.lower()}") for code in sorted(citiesByCountry)]
+    template = jinjaEnvironment().get_template("index.html")
+    with (directory / "index.html").open("w", encoding="utf-8") as f:
+        f.write(
+            template.render(
+                dict(cities=_links(cities), countries=countries, providers=providers)
+            )
+        )
+    for code, countryCities in citiesByCountry.items():
+        page = f"index-{code.lower()}"
+        mapPath = directory / f"map-{page}.html"
+        mergeTiles(
+            (
+                tilesDirectory(directory / f"map-{city.slug}.html")
+                for city in countryCities
+            ),
+            tilesDirectory(mapPath),
+        )
+        writeMap(mapPath, f"Nextbike {code}")
+        with (directory / f"{page}.html").open("w", encoding="utf-8") as f:
+            f.write(
+                template.render(
+                    dict(
+                        cities=_links(countryCities),
+                        countries=countries,
+                        providers=providers,
+                        mapLink=mapPath.name,
+                    )
+                )
+            )
@@ -1,20 +1,21 @@
-import difflib as SC
-import json
+from collections.abc import Sequence
 from dataclasses import dataclass
 from pathlib import Path
 from time import localtime, strftime
-from typing import cast
 
-from jinja2 import Environment, PackageLoader
+import geojson
 from starsep_utils import Element, GeoPoint, OverpassResult, Way, haversine
 
 import nextbike_parser as NP
-from geodesk_source import geodesk_bicycle_rentals
-from overpass_parser import fetchOverpassData
+from configuration import __VERSION__
+from jinja_environment import jinjaEnvironment
+from manifest import inputsDigest
+from metrics import labelled, span
+from osm_index import CentroidTable, RefIndex
+from overpass_parser import OverpassRequest
+from report_writer import FeatureWriter, pointFeature, reportExists
+from station_matcher import DISTANCE_THRESHOLD_MISMATCH, StationMatcher
 
-__VERSION__ = "3.0.0"
-
-DISTANCE_THRESHOLD_MISMATCH = 100
 MAX_DISTANCE = 1000000
 
 
@@ -27,6 +28,22 @@ class Match:
     matchedBy: str
     ratio: float = 0.0
 
+    def toGeoJSON(self) -> geojson.Feature:
+        return pointFeature(
+            self.nextbike.lat,
+            self.nextbike.lon,
+            dict(
+                name=self.nextbike.name,
+                ref=self.nextbike.num,
+                capacity=self.nextbike.stands,
+                osm=f"{self.osmType}/{self.osm.id}",
+                distance=self.distance,
+                matchedBy=self.matchedBy,
+                nameRatio=self.ratio,
+                mismatch=self.distance > DISTANCE_THRESHOLD_MISMATCH,
+            ),
+        )
+
 
 @dataclass
 class MapFeatureTags:
@@ -63,7 +80,7 @@ class MapFeature(GeoPoint):
                 tags=MapFeatureTags(
                     name=match.nextbike.name,
                     ref=match.nextbike.num,
-                    capacity=match.nextbike.stands,
+                    capacity=str(match.nextbike.stands),
                     extraTags=extraTags,
                 ),
             )
@@ -81,84 +98,52 @@ class MapFeature(GeoPoint):
         }
 
 
+def _isBicycleRental(element: Element) -> bool:
+    return element.tags.get("amenity") == "bicycle_rental"
+
+
 class NextbikeValidator:
     def __init__(self, nextbikeData, overpassResult: OverpassResult, html=None):
         self.nextbikeData = nextbikeData
         self.overpassResult = overpassResult
         self.matches: list[Match] = []
         self.html = html
-        self.envir = Environment(loader=PackageLoader("nextbike_valid", "templates"))
-        self.refMatches = dict()
+        self.envir = jinjaEnvironment()
+        self.centroids = CentroidTable(overpassResult)
+        self.refIndex = RefIndex(self.centroids)
+        self.matcher = StationMatcher(self.centroids, _isBicycleRental)
 
     def matchViaRef(self, place: NP.Place) -> tuple[Element | None, float]:
-        nextbikeRef = place.num
-        if nextbikeRef not in self.refMatches:
-            self.refMatches[nextbikeRef] = list()
         result = None
         bestDistance = MAX_DISTANCE
-        for element in self.overpassResult.allElements():
-            if "ref" in element.tags and element.tags["ref"] == nextbikeRef:
-                self.refMatches[nextbikeRef].append(
-                    [element, "way" if type(element) is Way else "node"]
-                )
-                point = element.center(self.overpassResult)
-                dist = haversine(place, point)
-                if dist < bestDistance:
-                    bestDistance = dist
-                    result = element
-        return result, bestDistance
-
-    def matchViaDistance(self, place: NP.Place) -> tuple[Element | None, float]:
-        bestDistance = MAX_DISTANCE
-        best: Element | None = None
-
-        for element in self.overpassResult.allElements():
-            if (
-                "amenity" not in element.tags
-                or element.tags["amenity"] != "bicycle_rental"
-            ):
-                continue
-            point = element.center(self.overpassResult)
-            dist = haversine(place, point)
+        for entry in self.refIndex.get(place.num):
+            dist = haversine(place, entry.center)
             if dist < bestDistance:
                 bestDistance = dist
-                best = element
-        return best, bestDistance
+                result = entry.element
+        return result, bestDistance
 
     def pair(self, nextPlaces: list[NP.Place]):
-        data = []
-        for nextPlace in nextPlaces:
-            matchedElement, dist = self.matchViaRef(nextPlace)
-            matchedBy = "id"
-            if matchedElement is None:
-                matchedElement, dist = self.matchViaDistance(nextPlace)
-                matchedBy = "di"
-            data.append(
-                Match(
-                    distance=dist,
-                    nextbike=nextPlace,
-                    osm=matchedElement,
-                    osmType="way" if type(matchedElement) is Way else "node",
-                    matchedBy=matchedBy,
-                )
+        refMatches = [self.matchViaRef(nextPlace) for nextPlace in nextPlaces]
+        self.matches = [
+            Match(
+                distance=dist,
+                nextbike=nextPlace,
+                osm=element,
+                osmType="way" if type(element) is Way else "node",
+                matchedBy=matchedBy,
             )
-        self.matches = data
+            for nextPlace, (element, dist, matchedBy) in zip(
+                nextPlaces, self.matcher.match(nextPlaces, refMatches), strict=True
+            )
+        ]
 
     def generateHtml(self, outputPath: Path, mapPath: Path, cityName: str):
         timestamp = strftime("%a, %d %b @ %H:%M:%S", localtime())
         template = self.envir.get_template("nextbike.html")
-        matches = []
-        for match in self.matches:
-            match.ratio = (
-                SC.SequenceMatcher(
-                    None, match.nextbike.name, match.osm.tags.get("name")
-                ).ratio()
-                if match.osm.tags.get("name") is not None
-                else 0
-            )
-            matches.append(match)
         csvPath = outputPath.with_suffix(".csv")
         kmlPath = outputPath.with_suffix(".kml")
+        geojsonPath = outputPath.with_suffix(".geojson")
         networkTags = dict(
             amenity="bicycle_rental",
             operator="Nextbike Polska",
@@ -169,53 +154,37 @@ class NextbikeValidator:
             networkTags["brand:wikidata"] = "Q3847868"
             networkTags["network"] = "Veturilo"
             networkTags["network:wikidata"] = "Q3847868"
-        mismatches = list(
-            filter(lambda m: m.distance > DISTANCE_THRESHOLD_MISMATCH, matches)
-        )
-        mapFeatures = list(map(MapFeature.fromMatch(networkTags), mismatches))
-        with outputPath.open("w", encoding="utf-8") as f:
+        with (
+            FeatureWriter(
+                mapPath, csvPath, kmlPath, geojsonPath, cityName, MapFeature.toJSON
+            ) as features,
+            outputPath.open("w", encoding="utf-8") as f,
+        ):
             context = {
-                "matches": matches,
+                "matches": self.matcher.reported(
+                    self.matches,
+                    lambda match: match.nextbike.name,
+                    outputPath.stem,
+                    features,
+                    MapFeature.fromMatch(networkTags),
+                ),
                 "timestamp": timestamp,
-                "countMismatches": len(mapFeatures),
+                "countMismatches": sum(
+                    match.distance > DISTANCE_THRESHOLD_MISMATCH
+                    for match in self.matches
+                ),
                 "VERSION": __VERSION__,
                 "distanceThreshold": DISTANCE_THRESHOLD_MISMATCH,
                 "cityName": cityName,
                 "mapLink": str(mapPath.name),
                 "csvLink": str(csvPath.name),
                 "kmlLink": str(kmlPath.name),
-                "refDuplicates": {
-                    ref: duplicates
-                    for ref, duplicates in self.refMatches.items()
-                    if len(duplicates) > 1
-                },
-            }
-            f.write(template.render(context))
-        self.generateMap(mapPath, mapFeatures, cityName)
-        self.generateCSV(csvPath, mapFeatures)
-        self.generateKML(kmlPath, mapFeatures)
-
-    def generateMap(self, mapPath: Path, mapFeatures: list[MapFeature], cityName: str):
-        mapFeaturesDict = list(map(lambda q: q.toJSON(), mapFeatures))
-        mapTemplate = self.envir.get_template("map.html")
-        with mapPath.open("w", encoding="utf-8") as f:
-            context = {
-                "featuresJson": json.dumps(mapFeaturesDict),
-                "cityName": cityName,
+                "geojsonLink": str(geojsonPath.name),
+                "refDuplicates": self.refIndex.duplicates(
+                    match.nextbike.num for match in self.matches
+                ),
             }
-            f.write(mapTemplate.render(context))
-
-    @staticmethod
-    def generateCSV(csvPath: Path, mapFeatures: list[MapFeature]):
-        with csvPath.open("w") as f:
-            for feature in mapFeatures:
-                f.write(feature.toCSV() + "\n")
-
-    def generateKML(self, kmlPath: Path, mapFeatures: list[MapFeature]):
-        kmlTemplate = self.envir.get_template("station.kml")
-        with kmlPath.open("w", encoding="utf-8") as f:
-            context = {"features": mapFeatures}
-            f.write(kmlTemplate.render(context))
+            f.writelines(template.generate(context))
 
     def containsData(self, path: Path):
         timek = strftime("%a, %d %b @ %H:%M:%S", localtime())
@@ -229,13 +198,27 @@ class NextbikeValidator:
         return True
 
 
-def _calculateBbox(data: list[NP.Place]) -> tuple[float, float, float, float]:
+def _calculateBbox(data: Sequence[NP.Place]) -> tuple[float, float, float, float]:
     latLonEpsilon = 0.002
+    if isinstance(data, NP.PlaceTable):
+        # Columns are read directly, without building Place objects
+        lats, lons = data.lats, data.lons
+    else:
+        lats = [place.lat for place in data]
+        lons = [place.lon for place in data]
     return (
-        min(place.lat for place in data) - latLonEpsilon,
-        min(place.lon for place in data) - latLonEpsilon,
-        max(place.lat for place in data) + latLonEpsilon,
-        max(place.lon for place in data) + latLonEpsilon,
+        min(lats) - latLonEpsilon,
+        min(lons) - latLonEpsilon,
+        max(lats) + latLonEpsilon,
+        max(lons) + latLonEpsilon,
+    )
+
+
+def nextbikeOverpassRequest(
+    nextbikeData: Sequence[NP.Place], cityName: str
+) -> OverpassRequest:
+    return OverpassRequest(
+        placeName=cityName, bbox=_calculateBbox(nextbikeData), admin_level=8
     )
 
 
@@ -254,13 +237,30 @@ def nextbike_run(
         nextbikeData = nextbikeParser.find_city(network)
     else:
         nextbikeData = nextbikeParser.find_network(network)
-    geodesk_bicycle_rentals(
-        place_name=cityName, bbox=_calculateBbox(nextbikeData), admin_level=8
-    )  # TODO: use geodesk result
-    overpassResult = fetchOverpassData(
-        placeName=cityName, bbox=_calculateBbox(nextbikeData), admin_level=8
-    )
-    validator = NextbikeValidator(nextbikeParser, overpassResult)
-    if validator.containsData(outputPath):
-        validator.pair(nextbikeData)
-        validator.generateHtml(outputPath, mapPath, cityName)
+    nextbike_compare(nextbikeData, cityName, outputPath, mapPath)
+
+
+def nextbike_compare(
+    nextbikeData: Sequence[NP.Place],
+    cityName: str,
+    outputPath: Path,
+    mapPath: Path | None = None,
+    previousDigest: str | None = None,
+) -> str:
+    """Matches and renders a single city, only needs picklable arguments.
+    Returns digest of inputs, output is kept if it matches previousDigest."""
+    # Places of a PlaceTable are built once, not on every iteration
+    nextbikeData = list(nextbikeData)
+    with labelled(provider="nextbike", city=cityName):
+        with span("overpass"):
+            overpassResult = nextbikeOverpassRequest(nextbikeData, cityName).fetch()
+        digest = inputsDigest(nextbikeData, overpassResult)
+        if digest == previousDigest and reportExists(outputPath, mapPath):
+            return digest
+        validator = NextbikeValidator(nextbikeData, overpassResult)
+        if validator.containsData(outputPath):
+            with span("pair"):
+                validator.pair(nextbikeData)
+            with span("render"):
+                validator.generateHtml(outputPath, mapPath, cityName)
+        return digest
@@ -0,0 +1,83 @@
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass
+
+from starsep_utils import Element, GeoPoint, OverpassResult, Relation, Way
+
+
+class CentroidTable:
+    """Centers of all nodes and ways of an OverpassResult as contiguous arrays.
+    Relations are skipped: starsep_utils can't compute their centers, so a
+    relation with a matching ref or amenity used to crash the comparison."""
+
+    def __init__(self, overpassResult: OverpassResult):
+        self.elements: list[Element] = []
+        self.ids = array("q")
+        self.types: list[str] = []
+        self.lats = array("d")
+        self.lons = array("d")
+        self.positions: dict[tuple[str, int], int] = {}
+        nodes = overpassResult.nodes
+        for element in overpassResult.allElements():
+            if type(element) is Relation:
+                continue
+            if type(element) is Way:
+                # Same summation order as Way.center, so results are identical
+                lat = sum(nodes[nodeId].lat for nodeId in element.nodes) / len(
+                    element.nodes
+                )
+                lon = sum(nodes[nodeId].lon for nodeId in element.nodes) / len(
+                    element.nodes
+                )
+            else:
+                lat, lon = element.lat, element.lon
+            self.positions[(element.type, element.id)] = len(self.elements)
+            self.elements.append(element)
+            self.ids.append(element.id)
+            self.types.append(element.type)
+            self.lats.append(lat)
+            self.lons.append(lon)
+
+    def __len__(self) -> int:
+        return len(self.elements)
+
+    def center(self, position: int) -> GeoPoint:
+        return GeoPoint(lat=self.lats[position], lon=self.lons[position])
+
+    def find(self, element: Element) -> int | None:
+        return self.positions.get((element.type, element.id))
+
+
+@dataclass(frozen=True)
+class RefEntry:
+    element: Element
+    osmType: str
+    center: GeoPoint
+
+
+class RefIndex:
+    """Elements of a CentroidTable grouped by their ref tag. Like the
+    CentroidTable, it has no relations."""
+
+    def __init__(self, centroids: CentroidTable):
+        self.entries: dict[str, list[RefEntry]] = defaultdict(list)
+        for position, element in enumerate(centroids.elements):
+            if "ref" not in element.tags:
+                continue
+            self.entries[element.tags["ref"]].append(
+                RefEntry(
+                    element=element,
+                    osmType=centroids.types[position],
+                    center=centroids.center(position),
+                )
+            )
+
+    def get(self, ref: str) -> list[RefEntry]:
+        return self.entries.get(ref, [])
+
+    def duplicates(self, refs) -> dict[str, list[RefEntry]]:
+        return {
+            ref: self.entries[ref]
+            for ref in dict.fromkeys(refs)
+            if len(self.entries.get(ref, [])) > 1
+        }
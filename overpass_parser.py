@@ -1,15 +1,164 @@
-import asyncio
+import math
 import time
+from dataclasses import dataclass
 
 from diskcache import Cache
-from starsep_utils import OverpassResult, downloadOverpassData
+from starsep_utils import Node, OverpassResult, Relation, RelationMember, Way
+from starsep_utils.overpass import KeyDict
 
-from configuration import OVERPASS_URL, cacheDirectory
+import http_client
+from configuration import (
+    OSM_SOURCE,
+    OVERPASS_CACHE_SIZE_LIMIT,
+    OVERPASS_CACHE_TTL,
+    OVERPASS_REFRESH_AGE,
+    OVERPASS_URL,
+    cacheDirectory,
+)
+from geodesk_source import geodesk_bicycle_rentals
+from metrics import count
+from overpass_storage import (
+    STORAGE_FORMAT,
+    packOverpassResult,
+    unpackOverpassResult,
+)
 
-cacheOverpass = Cache(str(cacheDirectory / "overpass"))
+cacheOverpass = Cache(
+    str(cacheDirectory / "overpass"),
+    size_limit=OVERPASS_CACHE_SIZE_LIMIT,
+    eviction_policy="least-recently-used",
+)
+# Overpass return 429 when requesting too often
+OVERPASS_COOLDOWN = 10
+# Bboxes are widened to 1/BBOX_STEPS degree, so small changes share a cache entry
+BBOX_STEPS = 100
+
+
+def _gridSteps(degrees: float) -> float:
+    # Rounded, so bounds already on the grid aren't moved by float error
+    return round(degrees * BBOX_STEPS, 6)
+
+
+def normalizeBbox(
+    bbox: tuple[float, float, float, float],
+) -> tuple[float, float, float, float]:
+    (minLat, minLon, maxLat, maxLon) = bbox
+    return (
+        math.floor(_gridSteps(minLat)) / BBOX_STEPS,
+        math.floor(_gridSteps(minLon)) / BBOX_STEPS,
+        math.ceil(_gridSteps(maxLat)) / BBOX_STEPS,
+        math.ceil(_gridSteps(maxLon)) / BBOX_STEPS,
+    )
+
+
+@dataclass(frozen=True)
+class OverpassRequest:
+    placeName: str
+    bbox: tuple[float, float, float, float]
+    admin_level: int
+
+    def __post_init__(self):
+        object.__setattr__(self, "bbox", normalizeBbox(self.bbox))
+
+    def fetch(self) -> OverpassResult:
+        """Cached result, stale one is used as well. Downloaded if missing."""
+        if OSM_SOURCE == "geodesk":
+            return geodesk_bicycle_rentals(
+                place_name=self.placeName, bbox=self.bbox, admin_level=self.admin_level
+            )
+        packed = cacheOverpass.get(self.cacheKey())
+        if packed is not None:
+            count("overpass_cache", result="hit")
+            return unpackOverpassResult(packed)
+        count("overpass_cache", result="miss")
+        result = fetchOverpassData(
+            placeName=self.placeName, bbox=self.bbox, admin_level=self.admin_level
+        )
+        self.store(result)
+        return result
+
+    def cacheKey(self) -> tuple:
+        return (
+            "overpass",
+            STORAGE_FORMAT,
+            self.placeName,
+            self.bbox,
+            self.admin_level,
+        )
+
+    def isStale(self) -> bool:
+        """Missing or older than OVERPASS_REFRESH_AGE"""
+        packed, expireTime = cacheOverpass.get(self.cacheKey(), expire_time=True)
+        if packed is None:
+            return True
+        age = OVERPASS_CACHE_TTL - (expireTime - time.time())
+        return age > OVERPASS_REFRESH_AGE
+
+    def store(self, result: OverpassResult):
+        cacheOverpass.set(
+            self.cacheKey(), packOverpassResult(result), expire=OVERPASS_CACHE_TTL
+        )
+
+
+def areaQuery(placeName: str, admin_level: int, areaSet: str) -> str:
+    return f"""
+    area[admin_level={admin_level}][name="{placeName}"]->.{areaSet};
+    (
+        nwr[amenity=bicycle_rental](area.{areaSet});
+        nwr[amenity=bicycle_parking]["disused:amenity"=bicycle_rental](area.{areaSet});
+    );
+    (._;>;);
+    """
+
+
+def bboxQuery(bbox: tuple[float, float, float, float]) -> str:
+    (minLat, minLon, maxLat, maxLon) = bbox
+    return f"""
+    (
+        nwr[amenity=bicycle_rental]({minLat}, {minLon}, {maxLat}, {maxLon});
+        nwr[amenity=bicycle_parking]["disused:amenity"=bicycle_rental]({minLat}, {minLon}, {maxLat}, {maxLon});
+    );
+    (._;>;);
+    """
+
+
+async def downloadOverpassElements(query: str) -> list[dict]:
+    response = await http_client.request(
+        "POST", OVERPASS_URL, data={"data": f"[out:json][timeout:250];\n{query}"}
+    )
+    return response.json()["elements"]
+
+
+def parseOverpassElements(elements: list[dict]) -> OverpassResult:
+    """Elements of Overpass JSON output, like starsep_utils parses them"""
+    nodes, ways, relations = {}, {}, {}
+    for element in elements:
+        tags = KeyDict(element.get("tags", {}))
+        if element["type"] == "node":
+            nodes[element["id"]] = Node(
+                id=element["id"],
+                type="node",
+                lat=element["lat"],
+                lon=element["lon"],
+                tags=tags,
+            )
+        elif element["type"] == "way":
+            ways[element["id"]] = Way(
+                id=element["id"], type="way", nodes=element["nodes"], tags=tags
+            )
+        elif element["type"] == "relation":
+            members = [
+                RelationMember(
+                    type=member["type"], id=member["ref"], role=member["role"]
+                )
+                for member in element["members"]
+            ]
+            relations[element["id"]] = Relation(
+                id=element["id"], type="relation", members=members, tags=tags
+            )
+    return OverpassResult(nodes=nodes, ways=ways, relations=relations)
 
 
-@cacheOverpass.memoize()
 def fetchOverpassData(
     placeName: str,
     bbox: tuple[float, float, float, float],
@@ -27,11 +176,6 @@ def fetchOverpassData(
     (._;>;);
     out body;
     """
-    result = asyncio.run(
-        downloadOverpassData(
-            query=query, overpassUrl=OVERPASS_URL, userAgent="starsep/NextbikeOSM"
-        ),
-    )
-    # Overpass return 429 when requesting too often
-    time.sleep(10)
+    result = parseOverpassElements(http_client.run(downloadOverpassElements(query)))
+    time.sleep(OVERPASS_COOLDOWN)
     return result
@@ -0,0 +1,96 @@
+import logging
+import time
+from collections import defaultdict
+
+import http_client
+from configuration import OSM_SOURCE
+from metrics import count
+from overpass_parser import (
+    OVERPASS_COOLDOWN,
+    OverpassRequest,
+    areaQuery,
+    bboxQuery,
+    downloadOverpassElements,
+    parseOverpassElements,
+)
+
+AREAS_PER_QUERY = 10
+_TYPE_ORDER = {"node": 0, "way": 1, "relation": 2}
+
+
+def _splitByCount(elements: list[dict]) -> list[list[dict]]:
+    """Splits elements of a query at `out count;` markers."""
+    parts: list[list[dict]] = [[]]
+    for element in elements:
+        if element["type"] == "count":
+            parts.append([])
+        else:
+            parts[-1].append(element)
+    return parts[:-1]
+
+
+class OverpassPlanner:
+    """Collects OverpassRequests of a run and downloads missing and stale ones
+    with a few union queries. Results are split per request locally and stored
+    in the Overpass cache, so OverpassRequest.fetch() doesn't hit the network.
+    Requests for the same area from different providers share a query part.
+    If refreshing fails, stale results are used until OVERPASS_CACHE_TTL."""
+
+    def __init__(self, areasPerQuery: int = AREAS_PER_QUERY):
+        self.areasPerQuery = areasPerQuery
+        self.requests: dict[OverpassRequest, None] = {}
+
+    def add(self, request: OverpassRequest):
+        self.requests[request] = None
+
+    def fetch(self):
+        if OSM_SOURCE != "overpass":
+            return
+        areas: dict[tuple[str, int], list[OverpassRequest]] = defaultdict(list)
+        for request in self.requests:
+            if request.isStale():
+                count("overpass_cache", result="stale")
+                areas[(request.placeName, request.admin_level)].append(request)
+            else:
+                count("overpass_cache", result="fresh")
+        areaKeys = list(areas)
+        for start in range(0, len(areaKeys), self.areasPerQuery):
+            batch = {
+                key: areas[key] for key in areaKeys[start : start + self.areasPerQuery]
+            }
+            try:
+                self._fetchBatch(batch)
+            except Exception:
+                # OverpassRequest.fetch() falls back to a query per request
+                logging.exception("Batched Overpass query failed")
+            time.sleep(OVERPASS_COOLDOWN)
+
+    @staticmethod
+    def _fetchBatch(batch: dict[tuple[str, int], list[OverpassRequest]]):
+        parts: list[str] = []
+        areaParts: dict[tuple[str, int], int] = {}
+        bboxParts: dict[tuple[float, float, float, float], int] = {}
+        for areaIndex, (placeName, admin_level) in enumerate(batch):
+            areaParts[(placeName, admin_level)] = len(parts)
+            parts.append(areaQuery(placeName, admin_level, f"area{areaIndex}"))
+            for request in batch[(placeName, admin_level)]:
+                if request.bbox not in bboxParts:
+                    bboxParts[request.bbox] = len(parts)
+                    parts.append(bboxQuery(request.bbox))
+        query = "".join(part + "out body;\nout count;\n" for part in parts)
+        elements = _splitByCount(http_client.run(downloadOverpassElements(query)))
+        if len(elements) != len(parts):
+            raise ValueError(f"Expected {len(parts)} parts, got {len(elements)}")
+        for areaKey, requests in batch.items():
+            for request in requests:
+                merged = {}
+                for element in (
+                    elements[areaParts[areaKey]] + elements[bboxParts[request.bbox]]
+                ):
+                    merged[(element["type"], element["id"])] = element
+                # Same order as Overpass `out body` of a single query
+                ordered = sorted(
+                    merged.values(),
+                    key=lambda element: (_TYPE_ORDER[element["type"]], element["id"]),
+                )
+                request.store(parseOverpassElements(ordered))
@@ -0,0 +1,155 @@
+import json
+import struct
+from array import array
+
+from starsep_utils import Node, OverpassResult, Relation, Way
+from starsep_utils.overpass import KeyDict, RelationMember
+
+# Part of Overpass cache keys, bumped when the layout changes
+STORAGE_FORMAT = 1
+_MAGIC = b"OPRC"
+_HEADER = struct.Struct("<4sI")
+_MEMBER_TYPES = ["node", "way", "relation"]
+
+# Columns in the order they're stored, native byte order as cache is local
+_COLUMNS = {
+    "nodeIds": "q",
+    "nodeLats": "d",
+    "nodeLons": "d",
+    "nodeTags": "I",
+    "wayIds": "q",
+    "wayTags": "I",
+    "wayNodeOffsets": "I",
+    "wayNodes": "q",
+    "relationIds": "q",
+    "relationTags": "I",
+    "memberOffsets": "I",
+    "memberTypes": "B",
+    "memberIds": "q",
+    "memberRoles": "I",
+    "tags": "I",
+}
+
+
+class _Strings:
+    """Interns tag keys, values and member roles"""
+
+    def __init__(self):
+        self.indices: dict[str, int] = {}
+
+    def __call__(self, string: str) -> int:
+        return self.indices.setdefault(string, len(self.indices))
+
+
+def packOverpassResult(result: OverpassResult) -> bytes:
+    """Columnar encoding of result: id and lat/lon arrays, offsets into
+    shared arrays of way nodes, relation members and interned tags."""
+    strings = _Strings()
+    columns = {name: array(typecode) for name, typecode in _COLUMNS.items()}
+    tags = columns["tags"]
+
+    def addTags(element, offsets: array):
+        for key, value in element.tags.items():
+            tags.append(strings(key))
+            tags.append(strings(value))
+        offsets.append(len(tags))
+
+    columns["nodeTags"].append(0)
+    for node in result.nodes.values():
+        columns["nodeIds"].append(node.id)
+        columns["nodeLats"].append(node.lat)
+        columns["nodeLons"].append(node.lon)
+        addTags(node, columns["nodeTags"])
+    columns["wayTags"].append(len(tags))
+    columns["wayNodeOffsets"].append(0)
+    for way in result.ways.values():
+        columns["wayIds"].append(way.id)
+        columns["wayNodes"].extend(way.nodes)
+        columns["wayNodeOffsets"].append(len(columns["wayNodes"]))
+        addTags(way, columns["wayTags"])
+    columns["relationTags"].append(len(tags))
+    columns["memberOffsets"].append(0)
+    for relation in result.relations.values():
+        columns["relationIds"].append(relation.id)
+        for member in relation.members:
+            columns["memberTypes"].append(_MEMBER_TYPES.index(member.type))
+            columns["memberIds"].append(member.id)
+            columns["memberRoles"].append(strings(member.role))
+        columns["memberOffsets"].append(len(columns["memberIds"]))
+        addTags(relation, columns["relationTags"])
+
+    header = json.dumps(
+        {
+            "strings": list(strings.indices),
+            "lengths": [len(column) for column in columns.values()],
+        }
+    ).encode()
+    return b"".join(
+        [_HEADER.pack(_MAGIC, len(header)), header]
+        + [column.tobytes() for column in columns.values()]
+    )
+
+
+def _tagDicts(offsets: list[int], tagStrings: list[str]) -> list[KeyDict]:
+    return [
+        KeyDict(
+            zip(tagStrings[start:end:2], tagStrings[start + 1 : end : 2], strict=True)
+        )
+        if start != end
+        else KeyDict()
+        for start, end in zip(offsets, offsets[1:], strict=False)
+    ]
+
+
+def unpackOverpassResult(data: bytes) -> OverpassResult:
+    magic, headerLength = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        raise ValueError("Not a packed OverpassResult")
+    position = _HEADER.size + headerLength
+    header = json.loads(data[_HEADER.size : position])
+    strings: list[str] = header["strings"]
+    view = memoryview(data)
+    columns: dict[str, list] = {}
+    for (name, typecode), length in zip(
+        _COLUMNS.items(), header["lengths"], strict=True
+    ):
+        column = array(typecode)
+        end = position + length * column.itemsize
+        column.frombytes(view[position:end])
+        # Lists are faster to iterate, as their ints already exist
+        columns[name] = column.tolist()
+        position = end
+    tagStrings = [strings[index] for index in columns["tags"]]
+
+    nodes = {}
+    nodeTags = _tagDicts(columns["nodeTags"], tagStrings)
+    for id, lat, lon, tags in zip(
+        columns["nodeIds"],
+        columns["nodeLats"],
+        columns["nodeLons"],
+        nodeTags,
+        strict=True,
+    ):
+        nodes[id] = Node(id=id, type="node", lat=lat, lon=lon, tags=tags)
+    ways = {}
+    wayNodes, wayNodeOffsets = columns["wayNodes"], columns["wayNodeOffsets"]
+    wayTags = _tagDicts(columns["wayTags"], tagStrings)
+    for index, (id, tags) in enumerate(zip(columns["wayIds"], wayTags, strict=True)):
+        nodeIds = wayNodes[wayNodeOffsets[index] : wayNodeOffsets[index + 1]]
+        ways[id] = Way(id=id, type="way", nodes=nodeIds, tags=tags)
+    relations = {}
+    memberOffsets = columns["memberOffsets"]
+    relationTags = _tagDicts(columns["relationTags"], tagStrings)
+    for index, (id, tags) in enumerate(
+        zip(columns["relationIds"], relationTags, strict=True)
+    ):
+        members = [
+            RelationMember(
+                type=_MEMBER_TYPES[columns["memberTypes"][member]],
+                id=columns["memberIds"][member],
+                role=strings[columns["memberRoles"][member]],
+            )
+            for member in range(memberOffsets[index], memberOffsets[index + 1])
+        ]
+        relations[id] = Relation(id=id, type="relation", members=members, tags=tags)
+    return OverpassResult(nodes=nodes, ways=ways, relations=relations)
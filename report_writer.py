@@ -0,0 +1,224 @@
+import json
+import math
+import shutil
+from collections.abc import Callable, Iterable
+from pathlib import Path
+from typing import IO, Any
+
+import geojson
+from jinja2 import Template
+
+from jinja_environment import jinjaEnvironment
+
+# Rendered in place of the streamed part of a template
+_STREAMED = "\0streamed\0"
+# Map features are split into slippy map tiles of this zoom, so a map
+# fetches only tiles in view
+TILE_ZOOM = 12
+# Bounds are [[south, west], [north, east]], as Leaflet expects
+Bounds = list[list[float]]
+
+
+def _writePrefix(f: IO[str], template: Template, context: dict) -> str:
+    """Writes template up to the streamed part, returns the rest"""
+    prefix, suffix = template.render(context).split(_STREAMED)
+    f.write(prefix)
+    return suffix
+
+
+def pointFeature(lat: float, lon: float, properties: dict) -> geojson.Feature:
+    return geojson.Feature(geometry=geojson.Point((lon, lat)), properties=properties)
+
+
+def tileOf(lat: float, lon: float) -> tuple[int, int]:
+    """x, y of the tile at TILE_ZOOM containing the point"""
+    n = 2**TILE_ZOOM
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tilesDirectory(mapPath: Path) -> Path:
+    """Tiles of map-krakow.html are in map-krakow/"""
+    return mapPath.with_suffix("")
+
+
+def reportExists(outputPath: Path, mapPath: Path | None) -> bool:
+    """Whether every file of a report was written. A report without OSM
+    data only has its page, so it's always regenerated."""
+    paths = [outputPath] + [
+        outputPath.with_suffix(suffix) for suffix in [".csv", ".kml", ".geojson"]
+    ]
+    if mapPath is not None:
+        # Tile index is written last, after all tiles
+        paths += [mapPath, tilesDirectory(mapPath) / "index.json"]
+    return all(path.exists() for path in paths)
+
+
+def _tilePath(directory: Path, tile: tuple[int, int]) -> Path:
+    x, y = tile
+    return directory / f"{x}-{y}.geojsonl"
+
+
+def _union(bounds: Bounds | None, other: Bounds | None) -> Bounds | None:
+    if bounds is None or other is None:
+        return bounds or other
+    (south, west), (north, east) = bounds
+    (otherSouth, otherWest), (otherNorth, otherEast) = other
+    return [
+        [min(south, otherSouth), min(west, otherWest)],
+        [max(north, otherNorth), max(east, otherEast)],
+    ]
+
+
+def _writeTileIndex(
+    directory: Path, tiles: Iterable[tuple[int, int]], bounds: Bounds | None
+):
+    (directory / "index.json").write_text(
+        json.dumps(dict(zoom=TILE_ZOOM, tiles=sorted(tiles), bounds=bounds))
+    )
+
+
+def _recreate(directory: Path):
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir(parents=True)
+
+
+def writeMap(mapPath: Path, title: str):
+    """Map page loading features from tilesDirectory(mapPath)"""
+    template = jinjaEnvironment().get_template("map.html")
+    with mapPath.open("w", encoding="utf-8") as f:
+        f.write(
+            template.render(
+                dict(cityName=title, tilesDirectory=tilesDirectory(mapPath).name)
+            )
+        )
+
+
+class TileWriter:
+    """Streams GeoJSON features to tiles of directory, a feature per line.
+    index.json lists written tiles and their bounds. Features are buffered
+    per tile and appended to tile files, so no file stays open."""
+
+    # Buffered features of all tiles before they're flushed
+    BUFFER_SIZE = 10000
+
+    def __init__(self, directory: Path):
+        _recreate(directory)
+        self.directory = directory
+        self.tiles: set[tuple[int, int]] = set()
+        self.buffers: dict[tuple[int, int], list[str]] = {}
+        self.buffered = 0
+        self.bounds: Bounds | None = None
+
+    def add(self, lat: float, lon: float, properties: dict):
+        tile = tileOf(lat, lon)
+        self.buffers.setdefault(tile, []).append(
+            geojson.dumps(pointFeature(lat, lon, properties)) + "\n"
+        )
+        self.buffered += 1
+        self.bounds = _union(self.bounds, [[lat, lon], [lat, lon]])
+        if self.buffered >= self.BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        for tile, lines in self.buffers.items():
+            with _tilePath(self.directory, tile).open("a", encoding="utf-8") as f:
+                f.writelines(lines)
+            self.tiles.add(tile)
+        self.buffers = {}
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        _writeTileIndex(self.directory, self.tiles, self.bounds)
+
+
+def mergeTiles(directories: Iterable[Path], target: Path):
+    """Concatenates tiles of directories into target. Directories without
+    index.json, like of cities which failed, are skipped."""
+    _recreate(target)
+    tiles: set[tuple[int, int]] = set()
+    bounds = None
+    for directory in directories:
+        indexPath = directory / "index.json"
+        if not indexPath.exists():
+            continue
+        index = json.loads(indexPath.read_text())
+        for x, y in index["tiles"]:
+            with (
+                _tilePath(directory, (x, y)).open("rb") as source,
+                _tilePath(target, (x, y)).open("ab") as f,
+            ):
+                shutil.copyfileobj(source, f)
+            tiles.add((x, y))
+        bounds = _union(bounds, index["bounds"])
+    _writeTileIndex(target, tiles, bounds)
+
+
+class GeoJSONWriter:
+    """Streams a GeoJSON FeatureCollection to path"""
+
+    def __init__(self, path: Path):
+        self.file = path.open("w", encoding="utf-8")
+        self.file.write('{"type": "FeatureCollection", "features": [\n')
+        self.count = 0
+
+    def add(self, feature: geojson.Feature):
+        if self.count > 0:
+            self.file.write(",\n")
+        self.file.write(geojson.dumps(feature))
+        self.count += 1
+
+    def close(self):
+        self.file.write("\n]}\n")
+        self.file.close()
+
+
+class FeatureWriter:
+    """Streams map features to map tiles, CSV and KML outputs as they're
+    added, and all matches to GeoJSON, so features of a city are never
+    collected in memory."""
+
+    def __init__(
+        self,
+        mapPath: Path,
+        csvPath: Path,
+        kmlPath: Path,
+        geojsonPath: Path,
+        cityName: str,
+        featureJSON: Callable[[Any], dict],
+    ):
+        environment = jinjaEnvironment()
+        self.featureJSON = featureJSON
+        self.placemark = environment.get_template("station.kml").module.placemark
+        writeMap(mapPath, cityName)
+        self.tiles = TileWriter(tilesDirectory(mapPath))
+        self.geojson = GeoJSONWriter(geojsonPath)
+        self.csvFile = csvPath.open("w")
+        self.kmlFile = kmlPath.open("w", encoding="utf-8")
+        self.kmlSuffix = _writePrefix(
+            self.kmlFile,
+            environment.get_template("station.kml"),
+            {"placemarks": _STREAMED},
+        )
+
+    def add(self, feature):
+        data = self.featureJSON(feature)
+        self.tiles.add(data["lat"], data["lon"], data["tags"])
+        self.csvFile.write(feature.toCSV() + "\n")
+        self.kmlFile.write(self.placemark(feature))
+
+    def export(self, feature: geojson.Feature):
+        """Adds a match or mismatch to GeoJSON output"""
+        self.geojson.add(feature)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.kmlFile.write(self.kmlSuffix)
+        self.tiles.close()
+        self.geojson.close()
+        for f in [self.csvFile, self.kmlFile]:
+            f.close()
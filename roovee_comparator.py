@@ -1,18 +1,19 @@
 import dataclasses
-import difflib as SC
-import json
 from dataclasses import dataclass
 from pathlib import Path
 from time import localtime, strftime
 
-from jinja2 import Environment, PackageLoader
-from starsep_utils import Element, GeoPoint, OverpassResult, Way, haversine
+import geojson
+from starsep_utils import Element, GeoPoint, OverpassResult, Way
 
-from overpass_parser import fetchOverpassData
+from jinja_environment import jinjaEnvironment
+from manifest import inputsDigest
+from metrics import labelled, span
+from osm_index import CentroidTable
+from overpass_parser import OverpassRequest
+from report_writer import FeatureWriter, pointFeature, reportExists
 from roovee_parser import Place, RooveeNetwork, RooveeParser
-
-DISTANCE_THRESHOLD_MISMATCH = 100
-MAX_DISTANCE = 1000000
+from station_matcher import DISTANCE_THRESHOLD_MISMATCH, StationMatcher
 
 
 @dataclass
@@ -21,8 +22,23 @@ class Match:
     place: Place
     osm: Element
     osmType: str
+    matchedBy: str
     ratio: float = 0.0
 
+    def toGeoJSON(self) -> geojson.Feature:
+        return pointFeature(
+            self.place.lat,
+            self.place.lon,
+            dict(
+                name=self.place.name,
+                osm=f"{self.osmType}/{self.osm.id}",
+                distance=self.distance,
+                matchedBy=self.matchedBy,
+                nameRatio=self.ratio,
+                mismatch=self.distance > DISTANCE_THRESHOLD_MISMATCH,
+            ),
+        )
+
 
 @dataclass
 class MapFeatureTags:
@@ -66,106 +82,72 @@ class MapFeature(GeoPoint):
         return f"{self.lat},{self.lon},addNode " + self.tags.toCSV()
 
 
+def _isBicycleRental(element: Element) -> bool:
+    return element.tags.get("amenity") == "bicycle_rental"
+
+
 class RooveeComparator:
     def __init__(self, data, overpassResult: OverpassResult, html=None):
         self.data = data
         self.overpassResult = overpassResult
         self.matches: list[Match] = []
         self.html = html
-        self.envir = Environment(loader=PackageLoader("roovee_comparator", "templates"))
-
-    def matchViaDistance(self, place: Place) -> tuple[Element | None, float]:
-        bestDistance = MAX_DISTANCE
-        best: Element | None = None
-
-        for element in self.overpassResult.allElements():
-            if (
-                "amenity" not in element.tags
-                or element.tags["amenity"] != "bicycle_rental"
-            ):
-                continue
-            point = element.center(self.overpassResult)
-            dist = haversine(place, point)
-            if dist < bestDistance:
-                bestDistance = dist
-                best = element
-        return best, bestDistance
+        self.envir = jinjaEnvironment()
+        self.centroids = CentroidTable(overpassResult)
+        self.matcher = StationMatcher(self.centroids, _isBicycleRental)
 
     def pair(self, places: list[Place]):
-        data = []
-        for place in places:
-            matchedElement, dist = self.matchViaDistance(place)
-            data.append(
-                Match(
-                    distance=dist,
-                    place=place,
-                    osm=matchedElement,
-                    osmType="way" if type(matchedElement) is Way else "node",
-                )
+        self.matches = [
+            Match(
+                distance=dist,
+                place=place,
+                osm=element,
+                osmType="way" if type(element) is Way else "node",
+                matchedBy=matchedBy,
+            )
+            for place, (element, dist, matchedBy) in zip(
+                places, self.matcher.match(places), strict=True
             )
-        self.matches = data
+        ]
 
     def generateHtml(self, outputPath: Path, mapPath: Path, cityName: str):
         timestamp = strftime("%a, %d %b @ %H:%M:%S", localtime())
         template = self.envir.get_template("roovee.html")
-        matches = []
-        for match in self.matches:
-            match.ratio = (
-                SC.SequenceMatcher(
-                    None, match.place.name, match.osm.tags.get("name")
-                ).ratio()
-                if match.osm.tags.get("name") is not None
-                else 0
-            )
-            matches.append(match)
         csvPath = outputPath.with_suffix(".csv")
         kmlPath = outputPath.with_suffix(".kml")
+        geojsonPath = outputPath.with_suffix(".geojson")
         networkTags = dict(
             amenity="bicycle_rental",
             operator="Roovee",
         )
         networkTags["operator:wikidata"] = "Q60860205"
-        mismatches = list(
-            filter(lambda m: m.distance > DISTANCE_THRESHOLD_MISMATCH, matches)
-        )
-        mapFeatures = list(map(MapFeature.fromMatch(networkTags), mismatches))
-        with outputPath.open("w", encoding="utf-8") as f:
+        with (
+            FeatureWriter(
+                mapPath, csvPath, kmlPath, geojsonPath, cityName, dataclasses.asdict
+            ) as features,
+            outputPath.open("w", encoding="utf-8") as f,
+        ):
             context = {
-                "matches": matches,
+                "matches": self.matcher.reported(
+                    self.matches,
+                    lambda match: match.place.name,
+                    outputPath.stem,
+                    features,
+                    MapFeature.fromMatch(networkTags),
+                ),
                 "timestamp": timestamp,
-                "countMismatches": len(mapFeatures),
+                "countMismatches": sum(
+                    match.distance > DISTANCE_THRESHOLD_MISMATCH
+                    for match in self.matches
+                ),
                 "distanceThreshold": DISTANCE_THRESHOLD_MISMATCH,
                 "cityName": cityName,
                 "mapLink": str(mapPath.name),
                 "csvLink": str(csvPath.name),
                 "kmlLink": str(kmlPath.name),
+                "geojsonLink": str(geojsonPath.name),
             }
-            f.write(template.render(context))
-        self.generateMap(mapPath, mapFeatures, cityName)
-        self.generateCSV(csvPath, mapFeatures)
-        self.generateKML(kmlPath, mapFeatures)
-
-    def generateMap(self, mapPath: Path, mapFeatures: list[MapFeature], cityName: str):
-        mapFeaturesDict = list(map(dataclasses.asdict, mapFeatures))
-        mapTemplate = self.envir.get_template("map.html")
-        with mapPath.open("w", encoding="utf-8") as f:
-            context = {
-                "featuresJson": json.dumps(mapFeaturesDict),
-                "cityName": cityName,
-            }
-            f.write(mapTemplate.render(context))
-
-    @staticmethod
-    def generateCSV(csvPath: Path, mapFeatures: list[MapFeature]):
-        with csvPath.open("w") as f:
-            for feature in mapFeatures:
-                f.write(feature.toCSV() + "\n")
-
-    def generateKML(self, kmlPath: Path, mapFeatures: list[MapFeature]):
-        kmlTemplate = self.envir.get_template("station.kml")
-        with kmlPath.open("w", encoding="utf-8") as f:
-            context = {"features": mapFeatures}
-            f.write(kmlTemplate.render(context))
+            f.writelines(template.generate(context))
 
     def containsData(self, path: Path):
         timek = strftime("%a, %d %b @ %H:%M:%S", localtime())
@@ -191,17 +173,34 @@ def _calculateBbox(data: list[Place]) -> tuple[float, float, float, float]:
     )
 
 
+def rooveeOverpassRequest(
+    network: RooveeNetwork, rooveeData: list[Place]
+) -> OverpassRequest:
+    return OverpassRequest(
+        placeName=network.name, bbox=_calculateBbox(rooveeData), admin_level=8
+    )
+
+
 def roovee_run(
     network: RooveeNetwork,
     outputPath: Path,
     rooveeParser: RooveeParser,
     mapPath: Path | None = None,
-):
-    rooveeData = rooveeParser.downloadNetwork(network)
-    overpassResult = fetchOverpassData(
-        placeName=network.name, bbox=_calculateBbox(rooveeData), admin_level=8
-    )
-    validator = RooveeComparator(rooveeParser, overpassResult)
-    if validator.containsData(outputPath):
-        validator.pair(rooveeData)
-        validator.generateHtml(outputPath, mapPath, network.name)
+    rooveeData: list[Place] | None = None,
+    previousDigest: str | None = None,
+) -> str:
+    with labelled(provider="roovee", city=network.name):
+        if rooveeData is None:
+            rooveeData = rooveeParser.downloadNetwork(network)
+        with span("overpass"):
+            overpassResult = rooveeOverpassRequest(network, rooveeData).fetch()
+        digest = inputsDigest(rooveeData, overpassResult)
+        if digest == previousDigest and reportExists(outputPath, mapPath):
+            return digest
+        validator = RooveeComparator(rooveeParser, overpassResult)
+        if validator.containsData(outputPath):
+            with span("pair"):
+                validator.pair(rooveeData)
+            with span("render"):
+                validator.generateHtml(outputPath, mapPath, network.name)
+        return digest
@@ -1,11 +1,19 @@
+import json
 from dataclasses import dataclass
 
-import httpx
-from starsep_utils import GeoPoint
+import http_client
+from configuration import cacheDirectory
+from metrics import labelled, span
 
+rooveeDirectory = cacheDirectory / "roovee"
 
-@dataclass(frozen=True)
-class Place(GeoPoint):
+
+@dataclass(frozen=True, slots=True)
+class Place:
+    """Like a GeoPoint, but slotted"""
+
+    lat: float
+    lon: float
     name: str
 
 
@@ -17,22 +25,35 @@ class RooveeNetwork:
 
 class RooveeParser:
     def downloadNetwork(self, network: RooveeNetwork) -> list[Place]:
-        data = httpx.get(
-            f"https://api.roovee.eu/public/bikesAndZones?tenant={network.tenant}"
-        ).json()
-        places: list[Place] = []
-        for zone in data["zones"]:
-            zoneType = zone["type"]
-            if zoneType == "operationsZone":
-                continue
-            if zoneType != "preferredBikeReturnZone":
-                print(f"Unexpected type = {zoneType}")
-                continue
-            places.append(
-                Place(
-                    name=zone["name"],
-                    lat=zone["areaCenter"]["lat"],
-                    lon=zone["areaCenter"]["lng"],
+        return http_client.run(self.fetchNetwork(network))
+
+    async def fetchNetwork(self, network: RooveeNetwork) -> list[Place]:
+        with labelled(city=network.name):
+            with span("download"):
+                content = await http_client.cachedGet(
+                    f"https://api.roovee.eu/public/bikesAndZones?tenant={network.tenant}",
+                    rooveeDirectory / f"{network.tenant}.json",
                 )
+            with span("parse"):
+                return parsePlaces(content)
+
+
+def parsePlaces(content: bytes) -> list[Place]:
+    """Preferred bike return zones of bikesAndZones response"""
+    data = json.loads(content)
+    places: list[Place] = []
+    for zone in data["zones"]:
+        zoneType = zone["type"]
+        if zoneType == "operationsZone":
+            continue
+        if zoneType != "preferredBikeReturnZone":
+            print(f"Unexpected type = {zoneType}")
+            continue
+        places.append(
+            Place(
+                name=zone["name"],
+                lat=zone["areaCenter"]["lat"],
+                lon=zone["areaCenter"]["lng"],
             )
-        return places
+        )
+    return places
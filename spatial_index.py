@@ -0,0 +1,196 @@
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from math import asin, cos, degrees, floor, radians, sin
+
+import numpy as np
+from starsep_utils import Element, GeoPoint, haversine
+
+from batch_distance import EARTH_RADIUS, haversineMany, prefilterNearest
+from osm_index import CentroidTable
+
+CELL_SIZE = 0.01
+INITIAL_RADIUS = 256
+MAX_DISTANCE = 1000000
+# Pairs further apart are only assigned if nothing closer is left
+ASSIGNMENT_RADIUS = 500
+# Metres of disagreement allowed between batch and scalar haversine
+DISTANCE_TOLERANCE = 2
+PREFILTER_MIN_CANDIDATES = 64
+
+
+def _cell(lat: float, lon: float) -> tuple[int, int]:
+    return floor(lat / CELL_SIZE), floor(lon / CELL_SIZE)
+
+
+def bboxMargins(point: GeoPoint, radius: float) -> tuple[float, float] | None:
+    """Returns lat/lon margins of a box containing every point within radius
+    metres, None if the box would cover a pole or the antimeridian."""
+    angular = radius / EARTH_RADIUS
+    dLat = degrees(angular) * 1.000001 + 1e-9
+    if abs(point.lat) + dLat >= 90:
+        return None
+    ratio = sin(angular) / cos(radians(point.lat))
+    if ratio >= 1:
+        return None
+    dLon = degrees(asin(ratio)) * 1.000001 + 1e-9
+    if point.lon - dLon < -180 or point.lon + dLon > 180:
+        return None
+    return dLat, dLon
+
+
+class SpatialIndex:
+    """Uniform lat/lon grid over centers of OSM elements accepted by predicate.
+    Ties are broken by position in overpassResult.allElements(), the same as
+    a linear scan with strict comparison."""
+
+    def __init__(
+        self,
+        centroids: CentroidTable,
+        predicate: Callable[[Element], bool],
+    ):
+        self.centroids = centroids
+        positions: list[int] = []
+        self.grid: dict[tuple[int, int], list[int]] = defaultdict(list)
+        for position, element in enumerate(centroids.elements):
+            if not predicate(element):
+                continue
+            cell = _cell(centroids.lats[position], centroids.lons[position])
+            self.grid[cell].append(len(positions))
+            positions.append(position)
+        self.positions = np.array(positions, dtype=np.intp)
+        self.lats = np.frombuffer(centroids.lats, dtype=np.float64)[self.positions]
+        self.lons = np.frombuffer(centroids.lons, dtype=np.float64)[self.positions]
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def _candidates(self, point: GeoPoint, radius: float) -> np.ndarray | None:
+        """Sorted indices of elements in bbox around point, None means all."""
+        margins = bboxMargins(point, radius)
+        if margins is None:
+            return None
+        dLat, dLon = margins
+        minLat, minLon = _cell(point.lat - dLat, point.lon - dLon)
+        maxLat, maxLon = _cell(point.lat + dLat, point.lon + dLon)
+        result = []
+        if (maxLat - minLat + 1) * (maxLon - minLon + 1) <= len(self.grid):
+            for cellLat in range(minLat, maxLat + 1):
+                for cellLon in range(minLon, maxLon + 1):
+                    result.extend(self.grid.get((cellLat, cellLon), ()))
+        else:
+            for (cellLat, cellLon), indices in self.grid.items():
+                if minLat <= cellLat <= maxLat and minLon <= cellLon <= maxLon:
+                    result.extend(indices)
+        result.sort()
+        return np.array(result, dtype=np.intp)
+
+    def _distance(self, point: GeoPoint, index: int) -> int:
+        return haversine(point, self.centroids.center(self.positions[index]))
+
+    def _element(self, index: int) -> Element:
+        return self.centroids.elements[self.positions[index]]
+
+    def _index(self, element: Element) -> int | None:
+        position = self.centroids.find(element)
+        if position is None:
+            return None
+        index = int(np.searchsorted(self.positions, position))
+        if index < len(self) and self.positions[index] == position:
+            return index
+        return None
+
+    def _closest(
+        self, point: GeoPoint, candidates: np.ndarray, maxDistance: int
+    ) -> tuple[Element | None, float]:
+        if len(candidates) > PREFILTER_MIN_CANDIDATES:
+            candidates = candidates[
+                prefilterNearest(
+                    point.lat, point.lon, self.lats[candidates], self.lons[candidates]
+                )
+            ]
+        best: Element | None = None
+        bestDistance = maxDistance
+        if len(candidates) == 0:
+            return best, bestDistance
+        distances = haversineMany(
+            point.lat, point.lon, self.lats[candidates], self.lons[candidates]
+        )
+        # Exact scalar haversine decides between the few closest candidates,
+        # so truncation and ties match starsep_utils.haversine
+        for index in candidates[distances < distances.min() + DISTANCE_TOLERANCE]:
+            dist = self._distance(point, index)
+            if dist < bestDistance:
+                bestDistance = dist
+                best = self._element(index)
+        return best, bestDistance
+
+    def nearest(
+        self, point: GeoPoint, maxDistance: int = MAX_DISTANCE
+    ) -> tuple[Element | None, float]:
+        radius = INITIAL_RADIUS
+        while True:
+            candidates = self._candidates(point, radius)
+            if candidates is None:
+                return self._closest(point, np.arange(len(self)), maxDistance)
+            best, bestDistance = self._closest(point, candidates, maxDistance)
+            # haversine is truncated to metres, so every element at bestDistance
+            # is closer than bestDistance + 1 <= radius and was a candidate
+            if bestDistance < radius or radius >= maxDistance:
+                return best, bestDistance
+            radius *= 4
+
+    def withinRadius(self, point: GeoPoint, radius: int) -> list[tuple[Element, int]]:
+        return [
+            (self._element(index), dist)
+            for index, dist in self._withinRadius(point, radius)
+        ]
+
+    def _withinRadius(self, point: GeoPoint, radius: int) -> list[tuple[int, int]]:
+        candidates = self._candidates(point, radius + 1)
+        if candidates is None:
+            candidates = np.arange(len(self))
+        distances = haversineMany(
+            point.lat, point.lon, self.lats[candidates], self.lons[candidates]
+        )
+        result = []
+        for index in candidates[distances < radius + DISTANCE_TOLERANCE]:
+            dist = self._distance(point, index)
+            if dist <= radius:
+                result.append((index, dist))
+        result.sort(key=lambda indexDistance: indexDistance[1])
+        return result
+
+    def assign(
+        self,
+        points: list[GeoPoint],
+        radius: int = ASSIGNMENT_RADIUS,
+        maxDistance: int = MAX_DISTANCE,
+        taken: Iterable[Element] = (),
+    ) -> list[tuple[Element | None, float]]:
+        """One-to-one matching of points and elements not in taken. Pairs
+        within radius are taken greedily by distance, then position, the rest
+        of points get their nearest element still free, in order. Points
+        left without a free element within maxDistance get None."""
+        edges: list[tuple[int, int, int]] = []
+        for pointIndex, point in enumerate(points):
+            for index, dist in self._withinRadius(point, radius):
+                edges.append((dist, pointIndex, index))
+        edges.sort()
+        takenIndices = {self._index(element) for element in taken} - {None}
+        result: list[tuple[Element | None, float] | None] = [None] * len(points)
+        for dist, pointIndex, index in edges:
+            if result[pointIndex] is None and index not in takenIndices:
+                result[pointIndex] = (self._element(index), dist)
+                takenIndices.add(index)
+        # Few elements are usually left, so they're scanned without the grid
+        free = np.setdiff1d(
+            np.arange(len(self)), np.fromiter(takenIndices, dtype=np.intp)
+        )
+        for pointIndex, point in enumerate(points):
+            if result[pointIndex] is not None:
+                continue
+            element, dist = self._closest(point, free, maxDistance)
+            if element is not None:
+                free = free[free != self._index(element)]
+            result[pointIndex] = (element, dist)
+        return result
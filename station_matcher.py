@@ -0,0 +1,135 @@
+from collections.abc import Callable, Container, Iterable, Iterator, Sequence
+from typing import Any, Protocol, TypeVar
+
+import geojson
+from starsep_utils import Element, GeoPoint
+
+from configuration import MATCHING
+from name_index import NameIndex, elementName
+from name_similarity import NameScores
+from osm_index import CentroidTable
+from report_writer import FeatureWriter
+from spatial_index import MAX_DISTANCE, SpatialIndex
+
+DISTANCE_THRESHOLD_MISMATCH = 100
+
+
+class Station(Protocol):
+    lat: float
+    lon: float
+    name: str
+
+
+class ReportedMatch(Protocol):
+    distance: float
+    osm: Element
+    ratio: float
+
+    def toGeoJSON(self) -> geojson.Feature: ...
+
+
+M = TypeVar("M", bound=ReportedMatch)
+
+
+class StationMatcher:
+    """Matches stations to OSM elements of centroids accepted by predicate.
+    Names of elements are read with osmName."""
+
+    def __init__(
+        self,
+        centroids: CentroidTable,
+        predicate: Callable[[Element], bool],
+        osmName: Callable[[Element], str | None] = elementName,
+    ):
+        self.centroids = centroids
+        self.osmName = osmName
+        self.spatialIndex = SpatialIndex(centroids, predicate)
+        self.nameIndex = NameIndex(centroids, predicate, osmName)
+
+    def nearest(self, station: GeoPoint) -> tuple[Element | None, float]:
+        return self.spatialIndex.nearest(station, MAX_DISTANCE)
+
+    def byName(
+        self, station: Station, excluded: Container[int] = ()
+    ) -> tuple[Element | None, float]:
+        return self.nameIndex.nearest(station, station.name, excluded)
+
+    def _reclaim(
+        self, claimed: set[int | None], assigned: Element | None, named: Element
+    ):
+        """Station matched by name frees the element assigned to it"""
+        if assigned is not None:
+            claimed.discard(self.centroids.find(assigned))
+        claimed.add(self.centroids.find(named))
+
+    def match(
+        self,
+        stations: Sequence[Station],
+        refMatches: Sequence[tuple[Element | None, float]] | None = None,
+    ) -> list[tuple[Element | None, float, str]]:
+        """Element, distance and matchedBy of each station. Elements of
+        refMatches, None for stations without one, are kept and matched "id".
+        Other stations get the nearest element, or the one with a similar
+        name if the nearest is further than DISTANCE_THRESHOLD_MISMATCH."""
+        if refMatches is None:
+            refMatches = [(None, MAX_DISTANCE)] * len(stations)
+        unmatched = [
+            station
+            for station, (element, _) in zip(stations, refMatches, strict=True)
+            if element is None
+        ]
+        oneToOne = MATCHING == "assignment"
+        claimed: set[int | None] = set()
+        if oneToOne:
+            refElements = [element for element, _ in refMatches if element is not None]
+            nearest = self.spatialIndex.assign(
+                unmatched, maxDistance=MAX_DISTANCE, taken=refElements
+            )
+            claimed = {
+                self.centroids.find(element)
+                for element in refElements
+                + [element for element, _ in nearest if element is not None]
+            }
+        else:
+            nearest = [self.nearest(station) for station in unmatched]
+        nearestMatches = iter(nearest)
+        result = []
+        for station, (element, dist) in zip(stations, refMatches, strict=True):
+            matchedBy = "id"
+            if element is None:
+                element, dist = next(nearestMatches)
+                matchedBy = "di"
+                if dist > DISTANCE_THRESHOLD_MISMATCH:
+                    # Nearest is unlikely the same station, a similar name may be
+                    named, namedDistance = self.byName(station, claimed)
+                    if named is not None:
+                        if oneToOne:
+                            self._reclaim(claimed, element, named)
+                        element, dist = named, namedDistance
+                        matchedBy = "name"
+                if element is None:
+                    # More stations than elements, the rest share their nearest
+                    element, dist = self.nearest(station)
+                    matchedBy = "shared"
+            result.append((element, dist, matchedBy))
+        return result
+
+    def reported(
+        self,
+        matches: Iterable[M],
+        stationName: Callable[[M], str],
+        report: str,
+        features: FeatureWriter,
+        toMapFeature: Callable[[M], Any],
+    ) -> Iterator[M]:
+        """Rates names of matches as the page is rendered from them. In the
+        same pass mismatches go to the map tiles, CSV and KML, and every match
+        to <city>.geojson."""
+        names = NameScores(report)
+        for match in matches:
+            match.ratio = names.ratio(stationName(match), self.osmName(match.osm))
+            if match.distance > DISTANCE_THRESHOLD_MISMATCH:
+                features.add(toMapFeature(match))
+            features.export(match.toGeoJSON())
+            yield match
+        names.save()
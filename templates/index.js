@@ -17,9 +17,43 @@ function showMarker(latLon, tags) {
     markersGroup.addLayer(marker);
 }
 
-features.forEach(feature => {
-    showMarker([feature["lat"], feature["lon"]], feature["tags"]);
-});
 markersGroup.addTo(map);
-map.fitBounds(markersGroup.getBounds());
+
+// Same as tileOf in report_writer.py
+function tileOf(lat, lon, zoom) {
+    const n = 2 ** zoom;
+    const x = Math.floor((lon + 180) / 360 * n);
+    const y = Math.floor((1 - Math.asinh(Math.tan(lat * Math.PI / 180)) / Math.PI) / 2 * n);
+    return [Math.min(Math.max(x, 0), n - 1), Math.min(Math.max(y, 0), n - 1)];
+}
+
+const loadedTiles = new Set();
+function loadTile(x, y) {
+    loadedTiles.add(`${x}-${y}`);
+    fetch(`${tilesDirectory}/${x}-${y}.geojsonl`)
+        .then(response => response.text())
+        .then(text => text.split("\n").filter(line => line).forEach(line => {
+            const feature = JSON.parse(line);
+            const [lon, lat] = feature.geometry.coordinates;
+            showMarker([lat, lon], feature.properties);
+        }));
+}
+
+function loadVisibleTiles(index) {
+    const bounds = map.getBounds();
+    const [minX, minY] = tileOf(bounds.getNorth(), bounds.getWest(), index.zoom);
+    const [maxX, maxY] = tileOf(bounds.getSouth(), bounds.getEast(), index.zoom);
+    index.tiles
+        .filter(([x, y]) => minX <= x && x <= maxX && minY <= y && y <= maxY)
+        .filter(([x, y]) => !loadedTiles.has(`${x}-${y}`))
+        .forEach(([x, y]) => loadTile(x, y));
+}
+
+fetch(`${tilesDirectory}/index.json`)
+    .then(response => response.json())
+    .then(index => {
+        if (index.bounds) map.fitBounds(index.bounds);
+        map.on('moveend', () => loadVisibleTiles(index));
+        loadVisibleTiles(index);
+    });
 
@@ -0,0 +1,10 @@
+import os
+import shutil
+import tempfile
+
+# Pipeline modules open their caches on import, under this directory
+os.environ["NEXTBIKEOSM_CACHE"] = tempfile.mkdtemp(prefix="nextbikeosm-tests-")
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(os.environ["NEXTBIKEOSM_CACHE"], ignore_errors=True)
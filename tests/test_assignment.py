@@ -0,0 +1,84 @@
+import random
+from collections import Counter
+
+from starsep_utils import GeoPoint, Node, OverpassResult
+
+from mevo_comparator import MevoComparator
+from mevo_parser import MevoParser, Station
+from osm_index import CentroidTable
+from spatial_index import SpatialIndex
+
+
+def _rental(nodeId: int, lat: float, lon: float, name: str) -> Node:
+    tags = {"amenity": "bicycle_rental", "name": name}
+    return Node(lat=lat, lon=lon, id=nodeId, type="node", tags=tags)
+
+
+def _overpassResult(nodes: list[Node]) -> OverpassResult:
+    return OverpassResult(
+        nodes={node.id: node for node in nodes}, ways={}, relations={}
+    )
+
+
+def _randomNodes(rnd: random.Random, count: int) -> list[Node]:
+    return [
+        _rental(
+            nodeId, rnd.uniform(52.1, 52.3), rnd.uniform(20.9, 21.1), f"Rynek {nodeId}"
+        )
+        for nodeId in range(1, count + 1)
+    ]
+
+
+def _assignedTwice(elements) -> list:
+    counts = Counter(element.id for element in elements if element is not None)
+    return [elementId for elementId, count in counts.items() if count > 1]
+
+
+def test_assign_is_one_to_one():
+    rnd = random.Random(1)
+    for stations in [50, 200, 400]:
+        nodes = _randomNodes(rnd, 200)
+        index = SpatialIndex(CentroidTable(_overpassResult(nodes)), lambda _: True)
+        points = [
+            GeoPoint(lat=rnd.uniform(52.1, 52.3), lon=rnd.uniform(20.9, 21.1))
+            for _ in range(stations)
+        ]
+        taken = nodes[:10]
+        assigned = [element for element, _ in index.assign(points, taken=taken)]
+        assert _assignedTwice(assigned + taken) == []
+        assert sum(element is not None for element in assigned) == min(stations, 190)
+
+
+def test_name_match_skips_element_assigned_further_than_threshold():
+    assigned = _rental(1, 52.0, 18.0, "Rynek 5")
+    other = _rental(2, 52.02, 18.0, "Dworzec")
+    comparator = MevoComparator(MevoParser(), _overpassResult([assigned, other]))
+    stations = [
+        # About 150 m from the first element, which is assigned to it
+        Station(lat=52.00135, lon=18.0, name="Szkoła 1", ref="1", capacity=5),
+        # Same name as the first element, but it's taken already
+        Station(lat=52.0042, lon=18.0, name="Rynek 5", ref="2", capacity=5),
+    ]
+    comparator.pair(stations)
+    assert [match.osm.id for match in comparator.matches] == [1, 2]
+    assert [match.matchedBy for match in comparator.matches] == ["di", "di"]
+
+
+def test_pair_shares_only_flagged_matches():
+    rnd = random.Random(2)
+    nodes = _randomNodes(rnd, 100)
+    comparator = MevoComparator(MevoParser(), _overpassResult(nodes))
+    stations = [
+        Station(
+            lat=rnd.uniform(52.1, 52.3),
+            lon=rnd.uniform(20.9, 21.1),
+            name=f"Rynek {rnd.randint(1, 150)}",
+            ref=str(ref),
+            capacity=5,
+        )
+        for ref in range(150)
+    ]
+    comparator.pair(stations)
+    owned = [match for match in comparator.matches if match.matchedBy != "shared"]
+    assert _assignedTwice(match.osm for match in owned) == []
+    assert len(owned) == len(nodes)
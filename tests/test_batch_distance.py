@@ -0,0 +1,72 @@
+import random
+
+import numpy as np
+from starsep_utils import GeoPoint, haversine
+
+from batch_distance import (
+    PREFILTER_MAX_DISTANCE,
+    haversineMany,
+    haversinePairwise,
+    prefilterNearest,
+)
+
+
+def _randomPoints(rnd: random.Random, count: int, spread: float) -> np.ndarray:
+    lat, lon = rnd.uniform(-70, 70), rnd.uniform(-179, 179)
+    return np.array(
+        [
+            (lat + rnd.uniform(-spread, spread), lon + rnd.uniform(-spread, spread))
+            for _ in range(count)
+        ]
+    )
+
+
+def test_haversine_many_matches_scalar():
+    rnd = random.Random(1)
+    for spread in [0.001, 0.1, 10]:
+        points = _randomPoints(rnd, 200, spread)
+        lat, lon = points[0]
+        distances = haversineMany(lat, lon, points[:, 0], points[:, 1])
+        for (otherLat, otherLon), distance in zip(points, distances, strict=True):
+            scalar = haversine(
+                GeoPoint(lat=lat, lon=lon), GeoPoint(lat=otherLat, lon=otherLon)
+            )
+            # Scalar haversine truncates to metres
+            assert scalar <= distance + 1e-6 and distance < scalar + 1 + 1e-6
+
+
+def test_haversine_pairwise_matches_many():
+    points = _randomPoints(random.Random(2), 50, 1)
+    matrix = haversinePairwise(
+        points[:10, 0], points[:10, 1], points[:, 0], points[:, 1]
+    )
+    assert matrix.shape == (10, 50)
+    for row, (lat, lon) in enumerate(points[:10]):
+        np.testing.assert_allclose(
+            matrix[row], haversineMany(lat, lon, points[:, 0], points[:, 1])
+        )
+
+
+def test_prefilter_keeps_nearest():
+    rnd = random.Random(3)
+    for _ in range(200):
+        spread = rnd.choice([0.001, 0.01, 0.1, 1])
+        points = _randomPoints(rnd, 300, spread)
+        lat, lon = points[0] + rnd.uniform(-spread, spread)
+        mask = prefilterNearest(lat, lon, points[1:, 0], points[1:, 1])
+        distances = [
+            haversine(GeoPoint(lat=lat, lon=lon), GeoPoint(lat=pLat, lon=pLon))
+            for pLat, pLon in points[1:]
+        ]
+        nearest = min(distances)
+        # Every point at the truncated nearest distance survives, ties included
+        for keep, distance in zip(mask, distances, strict=True):
+            if distance == nearest:
+                assert keep
+
+
+def test_prefilter_keeps_everything_when_far():
+    # Both points are over 1000 km away, beyond PREFILTER_MAX_DISTANCE
+    lats, lons = np.array([10.0, 20.0]), np.array([10.0, 20.0])
+    assert haversineMany(0.0, 0.0, lats, lons).min() > PREFILTER_MAX_DISTANCE
+    assert prefilterNearest(0.0, 0.0, lats, lons).all()
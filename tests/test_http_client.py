@@ -0,0 +1,22 @@
+import httpx
+import pytest
+
+import http_client
+
+
+async def _failingRequest(method: str, url: str, **kwargs) -> httpx.Response:
+    raise httpx.ConnectError("unreachable", request=httpx.Request(method, url))
+
+
+def test_failed_download_keeps_cached_body(tmp_path, monkeypatch):
+    monkeypatch.setattr(http_client, "request", _failingRequest)
+    path = tmp_path / "feed.json"
+    path.write_bytes(b'{"cached": true}')
+    content = http_client.run(http_client.cachedGet("https://example.com", path))
+    assert content == b'{"cached": true}'
+
+
+def test_failed_download_without_cached_body_raises(tmp_path, monkeypatch):
+    monkeypatch.setattr(http_client, "request", _failingRequest)
+    with pytest.raises(httpx.ConnectError):
+        http_client.run(http_client.cachedGet("https://example.com", tmp_path / "x"))
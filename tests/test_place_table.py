@@ -0,0 +1,48 @@
+from nextbike_parser import Place, PlaceTable
+from nextbike_valid import _calculateBbox
+
+
+def _places() -> list[Place]:
+    return [
+        Place(
+            lat=52.0 + i / 100,
+            lon=21.0 - i / 100,
+            uid=str(i),
+            name=f"Stacja {i}",
+            num=str(100 + i),
+            stands=i if i % 2 else None,
+        )
+        for i in range(10)
+    ]
+
+
+def _table(places: list[Place]) -> PlaceTable:
+    table = PlaceTable()
+    for place in places:
+        table.append(place)
+    return table
+
+
+def test_place_table_is_a_sequence_of_places():
+    places = _places()
+    table = _table(places)
+    assert len(table) == len(places)
+    assert list(table) == places
+    assert [table[i] for i in [0, 5, -1]] == [places[i] for i in [0, 5, -1]]
+    assert list(reversed(table)) == places[::-1]
+    assert places[3] in table
+    assert table.index(places[4]) == 4
+
+
+def test_place_table_slices():
+    places = _places()
+    table = _table(places)
+    for part in [slice(2, 5), slice(None, None, 3), slice(-3, None), slice(5, 2)]:
+        sliced = table[part]
+        assert isinstance(sliced, PlaceTable)
+        assert list(sliced) == places[part]
+
+
+def test_bbox_of_table_matches_places():
+    places = _places()
+    assert _calculateBbox(_table(places)) == _calculateBbox(places)
@@ -0,0 +1,104 @@
+import random
+
+from starsep_utils import GeoPoint, Node, OverpassResult, Way, haversine
+
+from osm_index import CentroidTable
+from spatial_index import CELL_SIZE, MAX_DISTANCE, SpatialIndex
+
+
+def _isBicycleRental(element) -> bool:
+    return element.tags.get("amenity") == "bicycle_rental"
+
+
+def _overpassResult(rnd: random.Random, count: int) -> OverpassResult:
+    """Rentals and other nodes around Warsaw, some sharing coordinates or
+    lying on cell borders, and a few rentals drawn as ways"""
+    nodes: dict[int, Node] = {}
+    ways: dict[int, Way] = {}
+    for nodeId in range(1, count + 1):
+        r = rnd.random()
+        if r < 0.2 and nodes:
+            # Same coordinates as an earlier node, so distances tie
+            other = nodes[rnd.randrange(1, nodeId)]
+            lat, lon = other.lat, other.lon
+        elif r < 0.4:
+            lat = round(rnd.uniform(52.1, 52.3) / CELL_SIZE) * CELL_SIZE
+            lon = round(rnd.uniform(20.9, 21.1) / CELL_SIZE) * CELL_SIZE
+        else:
+            lat, lon = rnd.uniform(52.1, 52.3), rnd.uniform(20.9, 21.1)
+        tags = {"amenity": "bicycle_rental" if rnd.random() < 0.7 else "bench"}
+        nodes[nodeId] = Node(lat=lat, lon=lon, id=nodeId, type="node", tags=tags)
+    for wayId in range(1, count // 10 + 1):
+        wayNodes = rnd.sample(sorted(nodes), 3)
+        ways[wayId] = Way(
+            id=wayId,
+            type="way",
+            tags={"amenity": "bicycle_rental"},
+            nodes=wayNodes + wayNodes[:1],
+        )
+    return OverpassResult(nodes=nodes, ways=ways, relations={})
+
+
+def _linearNearest(overpassResult: OverpassResult, point: GeoPoint):
+    """Matching before SpatialIndex, a scan with strict comparison"""
+    best = None
+    bestDistance = MAX_DISTANCE
+    for element in overpassResult.allElements():
+        if not _isBicycleRental(element):
+            continue
+        dist = haversine(point, element.center(overpassResult))
+        if dist < bestDistance:
+            best, bestDistance = element, dist
+    return best, bestDistance
+
+
+def _points(rnd: random.Random, overpassResult: OverpassResult) -> list[GeoPoint]:
+    nodes = list(overpassResult.nodes.values())
+    points = [
+        GeoPoint(lat=rnd.uniform(52.0, 52.4), lon=rnd.uniform(20.8, 21.2))
+        for _ in range(300)
+    ]
+    # Exactly on elements and on cell borders
+    points += [GeoPoint(lat=node.lat, lon=node.lon) for node in rnd.sample(nodes, 50)]
+    points += [
+        GeoPoint(
+            lat=round(rnd.uniform(52.1, 52.3) / CELL_SIZE) * CELL_SIZE,
+            lon=round(rnd.uniform(20.9, 21.1) / CELL_SIZE) * CELL_SIZE,
+        )
+        for _ in range(50)
+    ]
+    # Far away, so the search radius grows to the whole grid
+    points += [GeoPoint(lat=54.4, lon=18.6), GeoPoint(lat=-33.9, lon=151.2)]
+    return points
+
+
+def test_nearest_matches_linear_scan():
+    for seed in range(5):
+        rnd = random.Random(seed)
+        overpassResult = _overpassResult(rnd, 400)
+        index = SpatialIndex(CentroidTable(overpassResult), _isBicycleRental)
+        for point in _points(rnd, overpassResult):
+            assert index.nearest(point) == _linearNearest(overpassResult, point)
+
+
+def test_nearest_breaks_ties_by_element_order():
+    nodes = {
+        nodeId: Node(
+            lat=52.23,
+            lon=21.0,
+            id=nodeId,
+            type="node",
+            tags={"amenity": "bicycle_rental"},
+        )
+        for nodeId in [3, 1, 2]
+    }
+    overpassResult = OverpassResult(nodes=nodes, ways={}, relations={})
+    index = SpatialIndex(CentroidTable(overpassResult), _isBicycleRental)
+    element, _ = index.nearest(GeoPoint(lat=52.231, lon=21.001))
+    assert element is nodes[3]
+
+
+def test_nearest_without_elements():
+    overpassResult = OverpassResult(nodes={}, ways={}, relations={})
+    index = SpatialIndex(CentroidTable(overpassResult), _isBicycleRental)
+    assert index.nearest(GeoPoint(lat=52.23, lon=21.0)) == (None, MAX_DISTANCE)
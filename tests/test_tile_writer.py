@@ -0,0 +1,26 @@
+import json
+import random
+
+from report_writer import TileWriter, tileOf
+
+
+def test_flushed_tiles_keep_every_feature(tmp_path, monkeypatch):
+    monkeypatch.setattr(TileWriter, "BUFFER_SIZE", 7)
+    rnd = random.Random(25)
+    points = [(rnd.uniform(52.0, 52.4), rnd.uniform(20.8, 21.3)) for _ in range(100)]
+    writer = TileWriter(tmp_path / "tiles")
+    for i, (lat, lon) in enumerate(points):
+        writer.add(lat, lon, dict(id=i))
+    writer.close()
+
+    index = json.loads((tmp_path / "tiles" / "index.json").read_text())
+    assert sorted(map(tuple, index["tiles"])) == sorted(
+        {tileOf(lat, lon) for lat, lon in points}
+    )
+    ids = []
+    for x, y in index["tiles"]:
+        for line in (tmp_path / "tiles" / f"{x}-{y}.geojsonl").read_text().splitlines():
+            feature = json.loads(line)
+            assert tileOf(*points[feature["properties"]["id"]]) == (x, y)
+            ids.append(feature["properties"]["id"])
+    assert sorted(ids) == list(range(len(points)))